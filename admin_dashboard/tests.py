@@ -1,3 +1,112 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from customer_web.models import Category, Product, ProductInventory, StockMovement, StockReservation
+
+
+class InventoryLedgerTests(TestCase):
+    """Mọi thay đổi tồn kho từ dashboard phải ghi sổ cái và cộng dồn đúng vào Product.stock"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(self.staff)
+        self.category = Category.objects.create(name='Áo', slug='ao')
+        self.product = Product.objects.create(
+            name='Ao polo', slug='ao-polo', description='Áo polo', price=Decimal('150000'),
+            stock=7, sizes='M,L', colors='white',
+        )
+        self.product.categories.add(self.category)
+        self.medium = ProductInventory.objects.create(product=self.product, size='M', color='white', quantity=5, sku='polo-m')
+        self.large = ProductInventory.objects.create(product=self.product, size='L', color='white', quantity=2, sku='polo-l')
+
+    def edit_product(self, inventory):
+        data = {
+            'name': self.product.name,
+            'description': self.product.description,
+            'price': '150000',
+            'categories': [self.category.pk],
+            'sizes': 'M,L,XL',
+            'colors': 'white',
+        }
+        for (size, color), quantity in inventory.items():
+            data[f'inventory[{size}][{color}][quantity]'] = str(quantity)
+            data[f'inventory[{size}][{color}][sku]'] = ''
+        return self.client.post(reverse('admin_dashboard:product_edit', args=[self.product.pk]), data)
+
+    def deltas(self):
+        return {
+            (size, color): delta
+            for size, color, delta in StockMovement.objects.values_list('size', 'color', 'delta')
+        }
+
+    def test_product_edit_updates_variants_in_place(self):
+        reservation = StockReservation.objects.create(
+            inventory=self.medium, holder='session:a', quantity=1, expires_at=timezone.now() + timedelta(minutes=15)
+        )
+
+        self.edit_product({('M', 'white'): 8, ('L', 'white'): 0, ('XL', 'white'): 4})
+
+        self.medium.refresh_from_db()
+        self.assertEqual(self.medium.quantity, 8)
+        self.assertFalse(ProductInventory.objects.filter(pk=self.large.pk).exists())
+        self.assertEqual(ProductInventory.objects.get(product=self.product, size='XL').quantity, 4)
+        # Dòng tồn kho được sửa tại chỗ nên giữ hàng đang hiệu lực không bị xóa theo
+        self.assertTrue(StockReservation.objects.filter(pk=reservation.pk).exists())
+        self.assertEqual(self.deltas(), {('M', 'white'): 3, ('L', 'white'): -2, ('XL', 'white'): 4})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 12)
+
+    def test_bulk_inventory_records_each_variant(self):
+        self.client.post(reverse('admin_dashboard:bulk_inventory'), {
+            'product': self.product.pk,
+            'sizes': ['M', 'XL'],
+            'colors': ['white'],
+            'operation': 'add',
+            'quantity': 3,
+        })
+
+        quantities = dict(ProductInventory.objects.filter(product=self.product).values_list('size', 'quantity'))
+        self.assertEqual(quantities, {'M': 8, 'L': 2, 'XL': 3})
+        self.assertEqual(self.deltas(), {('M', 'white'): 3, ('XL', 'white'): 3})
+        self.assertEqual(set(StockMovement.objects.values_list('reason', flat=True)), {'import'})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 13)
+
+    def test_bulk_subtract_never_goes_negative(self):
+        self.client.post(reverse('admin_dashboard:bulk_inventory'), {
+            'product': self.product.pk,
+            'sizes': ['M', 'L'],
+            'colors': ['white'],
+            'operation': 'subtract',
+            'quantity': 3,
+        })
+
+        quantities = dict(ProductInventory.objects.filter(product=self.product).values_list('size', 'quantity'))
+        self.assertEqual(quantities, {'M': 2, 'L': 0})
+        self.assertEqual(self.deltas(), {('M', 'white'): -3, ('L', 'white'): -2})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+    def test_inventory_edit_and_delete_record_movements(self):
+        self.client.post(reverse('admin_dashboard:inventory_edit', args=[self.medium.pk]), {
+            'product': self.product.pk,
+            'size': 'M',
+            'color': 'white',
+            'quantity': 1,
+        })
+        self.client.post(reverse('admin_dashboard:inventory_delete', args=[self.large.pk]))
 
-# Create your tests here.
+        self.medium.refresh_from_db()
+        self.assertEqual(self.medium.quantity, 1)
+        self.assertFalse(ProductInventory.objects.filter(pk=self.large.pk).exists())
+        self.assertEqual(
+            sorted(StockMovement.objects.values_list('size', 'delta', 'reason')),
+            [('L', -2, 'removal'), ('M', -4, 'adjustment')],
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
@@ -35,6 +35,10 @@ urlpatterns = [
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
     path('orders/bulk-action/', views.bulk_order_action, name='bulk_order_action'),
     
+    # Công việc nền (dead-letter)
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/action/', views.job_action, name='job_action'),
+    
     # Quản lý tồn kho
     path('inventory/', views.inventory_list, name='inventory_list'),
     # path('inventory/add/', views.inventory_add, name='inventory_add'),
@@ -5,104 +5,28 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q, Count, Sum
 from django.utils.text import slugify
 from django.utils import timezone
 from datetime import datetime, timedelta
-from customer_web.models import Product, Category, Order, OrderItem, CustomerProfile, ProductInventory, ProductImage
+from customer_web.models import Product, Category, Order, OrderItem, CustomerProfile, ProductInventory, ProductImage, ProductCard, Job
+from customer_web.pagination import CursorPaginator
+from customer_web.jobs import requeue
+from customer_web.orders import OrderStateMachine, InvalidTransition
+from customer_web.stock import diff_movements, generate_unique_sku, movement, record_movements, variant_quantities
 from .models import News, DashboardSettings, NewsCategory
 from .forms import NewsForm, NewsCategoryForm
 from .inventory_forms import ProductInventoryForm, BulkInventoryForm
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Check if user is admin/staff
 def is_admin(user):
     return user.is_authenticated and (user.is_staff or user.is_superuser)
 
-def update_inventory_on_status_change(order, old_status, new_status):
-    """Tự động cập nhật tồn kho ProductInventory khi trạng thái đơn hàng thay đổi"""
-    try:
-        # Khi đơn hàng bị hủy - khôi phục lại tồn kho
-        if new_status == 'cancelled' and old_status in ['pending', 'confirmed', 'processing']:
-            for item in order.items.all():
-                try:
-                    inventory = ProductInventory.objects.get(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color
-                    )
-                    inventory.quantity += item.quantity
-                    inventory.save()
-                except ProductInventory.DoesNotExist:
-                    # Tạo mới inventory nếu chưa có
-                    sku = generate_unique_sku(item.product, item.color, item.size)
-                    ProductInventory.objects.create(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color,
-                        quantity=item.quantity,
-                        sku=sku
-                    )
-        
-        # Khi đơn hàng được hoàn trả hoàn tất - khôi phục lại tồn kho
-        elif new_status == 'returned' and old_status in ['return_requested', 'return_approved']:
-            for item in order.items.all():
-                try:
-                    inventory = ProductInventory.objects.get(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color
-                    )
-                    inventory.quantity += item.quantity
-                    inventory.save()
-                except ProductInventory.DoesNotExist:
-                    # Tạo mới inventory nếu chưa có
-                    sku = generate_unique_sku(item.product, item.color, item.size)
-                    ProductInventory.objects.create(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color,
-                        quantity=item.quantity,
-                        sku=sku
-                    )
-        
-        # Khi đơn hàng được xác nhận/xử lý lần đầu - trừ tồn kho ProductInventory
-        elif new_status in ['confirmed', 'processing'] and old_status == 'pending':
-            for item in order.items.all():
-                try:
-                    inventory = ProductInventory.objects.get(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color
-                    )
-                    # Chỉ trừ nếu còn đủ hàng
-                    if inventory.quantity >= item.quantity:
-                        inventory.quantity -= item.quantity
-                        inventory.save()
-                    else:
-                        # Log warning but don't block the status change
-                        print(f"Warning: Not enough inventory for {item.product.name} - {item.size} - {item.color}")
-                except ProductInventory.DoesNotExist:
-                    # Log warning but don't block the status change
-                    print(f"Warning: No inventory found for {item.product.name} - {item.size} - {item.color}")
-    
-    except Exception as e:
-        print(f"Error updating inventory: {str(e)}")
-        # Don't block status change due to inventory errors
-
-def generate_unique_sku(product, color, size):
-    """Generate unique SKU for inventory item"""
-    base_sku = f"{slugify(product.name)}-{slugify(color)}-{size}"
-    sku = base_sku
-    counter = 1
-    
-    # Ensure SKU is unique across all products
-    while ProductInventory.objects.filter(sku=sku).exists():
-        sku = f"{base_sku}-{counter}"
-        counter += 1
-    
-    return sku
-
 def process_product_images(request, product):
     """Xử lý upload và cập nhật ảnh sản phẩm"""
     try:
@@ -164,6 +88,9 @@ def process_product_images(request, product):
                         ProductImage.objects.filter(id=image_id, product=product).update(alt_text=value)
                 except:
                     pass
+        
+        # Các lệnh update() ở trên không phát signal nên cần đồng bộ card thủ công
+        ProductCard.refresh([product.pk])
                     
     except Exception as e:
         print(f"Error processing images: {str(e)}")  # Debug logging
@@ -192,30 +119,60 @@ def process_inventory_data(request, product):
                         'sku': sku
                     }
         
-        # Xóa inventory cũ của sản phẩm này
-        product.inventory.all().delete()
-        
-        # Tạo inventory mới
-        for key, data in inventory_data.items():
-            if data['quantity'] > 0:  # Chỉ tạo khi có số lượng > 0
-                # Generate unique SKU if not provided or if it conflicts
-                if not data['sku'] or ProductInventory.objects.filter(sku=data['sku']).exists():
-                    data['sku'] = generate_unique_sku(product, data['color'], data['size'])
+        # Cập nhật tồn kho của sản phẩm tại chỗ trong một transaction, ghi sổ cái theo chênh lệch số lượng.
+        # Không xóa rồi tạo lại: xóa dòng tồn kho sẽ xóa theo các giữ hàng (StockReservation) đang hiệu lực.
+        with transaction.atomic():
+            # Khóa các dòng hiện có trước khi đọc số lượng cũ để đơn hàng đồng thời không bị ghi đè
+            existing = {
+                (item.size, item.color): item
+                for item in ProductInventory.objects.filter(product=product).order_by('pk').select_for_update()
+            }
+            before = variant_quantities(existing.values())
+            
+            after = {}
+            removed = []
+            for (size, color), inventory in existing.items():
+                data = inventory_data.get(f"{size}-{color}")
+                if not data or data['quantity'] <= 0:
+                    # Biến thể hết hàng hoặc bị bỏ khỏi form
+                    removed.append(inventory.pk)
+                    continue
+                after[(product.pk, size, color)] = data['quantity']
+                update_fields = []
+                if inventory.quantity != data['quantity']:
+                    inventory.quantity = data['quantity']
+                    update_fields.append('quantity')
+                if data['sku'] and data['sku'] != inventory.sku and not ProductInventory.objects.filter(sku=data['sku']).exists():
+                    inventory.sku = data['sku']
+                    update_fields.append('sku')
+                if update_fields:
+                    inventory.save(update_fields=update_fields + ['updated_at'])
+            if removed:
+                ProductInventory.objects.filter(pk__in=removed).delete()
+            
+            # Tạo các biến thể mới
+            for key, data in inventory_data.items():
+                if data['quantity'] > 0 and (data['size'], data['color']) not in existing:  # Chỉ tạo khi có số lượng > 0
+                    # Generate unique SKU if not provided or if it conflicts
+                    if not data['sku'] or ProductInventory.objects.filter(sku=data['sku']).exists():
+                        data['sku'] = generate_unique_sku(product, data['color'], data['size'])
                 
-                ProductInventory.objects.create(
-                    product=product,
-                    size=data['size'],
-                    color=data['color'],
-                    quantity=data['quantity'],
-                    sku=data['sku']
-                )
-        
-        # Cập nhật stock tổng
-        product.update_stock_from_inventory()
+                    ProductInventory.objects.create(
+                        product=product,
+                        size=data['size'],
+                        color=data['color'],
+                        quantity=data['quantity'],
+                        sku=data['sku']
+                    )
+                    after[(product.pk, data['size'], data['color'])] = data['quantity']
+            
+            # Ghi sổ cái; Product.stock được cộng dồn theo chênh lệch
+            record_movements(diff_movements(before, after, 'adjustment', actor=request.user))
         
-    except Exception as e:
-        print(f"Error processing inventory data: {e}")
-        pass  # Không làm crash form chính
+    except Exception:
+        # Tồn kho đã được rollback; không làm crash form chính nhưng báo cho người quản trị
+        logger.exception('Error processing inventory data for product %s', product.pk)
+        messages.error(request, 'Không lưu được tồn kho của sản phẩm, vui lòng kiểm tra lại dữ liệu tồn kho')
 
 @login_required
 @user_passes_test(is_admin)
@@ -263,7 +220,7 @@ def product_list(request):
     query = request.GET.get('q', '')
     category_id = request.GET.get('category', '')
     
-    products = Product.objects.prefetch_related('categories').order_by('-created_at')
+    products = Product.objects.prefetch_related('categories')
     
     if query:
         products = products.filter(
@@ -276,9 +233,8 @@ def product_list(request):
     
     categories = Category.objects.all()
     
-    paginator = Paginator(products, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(products, 20, ['-created_at'])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -364,7 +320,11 @@ def product_edit(request, product_id):
             product.colors = request.POST.get('colors')
             product.is_featured = request.POST.get('is_featured') == 'on'
             product.is_hot_trend = request.POST.get('is_hot_trend') == 'on'
-            product.save()
+            # Không ghi đè stock (được cập nhật theo delta bởi các giao dịch tồn kho đồng thời)
+            product.save(update_fields=[
+                'name', 'slug', 'description', 'price', 'discount_price',
+                'sizes', 'colors', 'is_featured', 'is_hot_trend', 'updated_at',
+            ])
             
             # Xử lý inventory data (nếu có)
             process_inventory_data(request, product)
@@ -514,7 +474,7 @@ def order_list(request):
     status = request.GET.get('status', '')
     query = request.GET.get('q', '')
     
-    orders = Order.objects.select_related('user').order_by('-created_at')
+    orders = Order.objects.select_related('user')
     
     if status:
         orders = orders.filter(status=status)
@@ -526,23 +486,18 @@ def order_list(request):
             Q(phone__icontains=query)
         )
     
-    paginator = Paginator(orders, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Tính toán thống kê theo trạng thái (một truy vấn GROUP BY)
+    order_stats = {value: 0 for value, label in Order.STATUS_CHOICES}
+    for row in Order.objects.order_by().values('status').annotate(total=Count('id')):
+        order_stats[row['status']] = row['total']
     
-    # Tính toán thống kê theo trạng thái
-    order_stats = {
-        'pending': Order.objects.filter(status='pending').count(),
-        'confirmed': Order.objects.filter(status='confirmed').count(),
-        'processing': Order.objects.filter(status='processing').count(),
-        'shipping': Order.objects.filter(status='shipping').count(),
-        'delivered': Order.objects.filter(status='delivered').count(),
-        'cancelled': Order.objects.filter(status='cancelled').count(),
-        'return_requested': Order.objects.filter(status='return_requested').count(),
-        'return_approved': Order.objects.filter(status='return_approved').count(),
-        'returned': Order.objects.filter(status='returned').count(),
-        'refunded': Order.objects.filter(status='refunded').count(),
-    }
+    # Tổng số chỉ có sẵn khi không tìm kiếm theo từ khóa
+    total = None
+    if not query:
+        total = order_stats.get(status, 0) if status else sum(order_stats.values())
+    
+    paginator = CursorPaginator(orders, 20, ['-created_at'], count=total)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     status_choices = Order.STATUS_CHOICES
     
@@ -567,28 +522,14 @@ def order_detail(request, order_id):
         
         if action == 'update_status':
             new_status = request.POST.get('status')
-            if new_status in dict(Order.STATUS_CHOICES):
-                old_status = order.status
-                order.status = new_status
-                
-                # Auto-update inventory based on status change
-                update_inventory_on_status_change(order, old_status, new_status)
-                
-                # Cập nhật thông tin hoàn trả tự động
-                if new_status == 'return_requested' and old_status != 'return_requested':
-                    order.return_requested_at = timezone.now()
-                elif new_status == 'return_approved' and old_status != 'return_approved':
-                    order.return_approved_at = timezone.now()
-                elif new_status == 'returned' and old_status != 'returned':
-                    order.return_completed_at = timezone.now()
-                elif new_status == 'refunded' and old_status != 'refunded':
-                    order.refund_completed_at = timezone.now()
-                    if not order.refund_amount:
-                        order.refund_amount = order.total_amount
-                
-                order.save()
-                messages.success(request, f'Đã cập nhật trạng thái đơn hàng thành "{order.get_status_display()}"')
-                return redirect('admin_dashboard:order_detail', order_id=order_id)
+            if new_status in dict(Order.STATUS_CHOICES) and new_status != order.status:
+                try:
+                    OrderStateMachine(order).transition(new_status, actor=request.user)
+                except InvalidTransition as e:
+                    messages.error(request, str(e))
+                else:
+                    messages.success(request, f'Đã cập nhật trạng thái đơn hàng thành "{order.get_status_display()}"')
+            return redirect('admin_dashboard:order_detail', order_id=order_id)
         
         elif action == 'update_return_info':
             order.return_reason = request.POST.get('return_reason', '')
@@ -600,14 +541,15 @@ def order_detail(request, order_id):
                     messages.error(request, 'Số tiền hoàn không hợp lệ')
                     return redirect('admin_dashboard:order_detail', order_id=order_id)
             
-            order.save()
+            order.save(update_fields=['return_reason', 'refund_amount', 'updated_at'])
             messages.success(request, 'Đã cập nhật thông tin hoàn trả')
             return redirect('admin_dashboard:order_detail', order_id=order_id)
     
+    allowed = OrderStateMachine(order).allowed_transitions()
     context = {
         'order': order,
         'order_items': order_items,
-        'status_choices': Order.STATUS_CHOICES,
+        'status_choices': [(value, label) for value, label in Order.STATUS_CHOICES if value == order.status or value in allowed],
     }
     return render(request, 'admin_dashboard/order_detail.html', context)
 
@@ -623,46 +565,97 @@ def bulk_order_action(request):
             messages.error(request, 'Vui lòng chọn ít nhất một đơn hàng')
             return redirect('admin_dashboard:order_list')
         
-        orders = Order.objects.filter(id__in=order_ids)
-        success_count = 0
+        # Mỗi thao tác hàng loạt chuyển đơn sang một trạng thái đích qua OrderStateMachine
+        targets = {
+            'mark_shipped': 'shipping',
+            'mark_delivered': 'delivered',
+            'approve_returns': 'return_approved',
+            'mark_refunded': 'refunded',
+        }
+        new_status = targets.get(action)
+        if new_status is None:
+            messages.error(request, 'Thao tác không hợp lệ')
+            return redirect('admin_dashboard:order_list')
         
         try:
-            for order in orders:
-                if action == 'mark_shipped':
-                    if order.status in ['confirmed', 'processing']:
-                        order.status = 'shipping'
-                        order.save()
-                        success_count += 1
-                elif action == 'mark_delivered':
-                    if order.status == 'shipping':
-                        order.status = 'delivered'
-                        order.save()
-                        success_count += 1
-                elif action == 'approve_returns':
-                    if order.status == 'return_requested':
-                        order.status = 'return_approved'
-                        order.return_approved_at = timezone.now()
-                        order.save()
-                        success_count += 1
-                elif action == 'mark_refunded':
-                    if order.status in ['return_approved', 'returned']:
-                        order.status = 'refunded'
-                        order.refund_completed_at = timezone.now()
-                        if not order.refund_amount:
-                            order.refund_amount = order.total_amount
-                        order.save()
-                        success_count += 1
-            
-            if success_count > 0:
-                messages.success(request, f'Đã cập nhật {success_count} đơn hàng thành công')
-            else:
-                messages.warning(request, 'Không có đơn hàng nào được cập nhật')
-                
+            updated_ids, skipped = OrderStateMachine.bulk_transition(
+                [order_id for order_id in order_ids if order_id.isdigit()], new_status, actor=request.user
+            )
         except Exception as e:
             messages.error(request, f'Có lỗi xảy ra: {str(e)}')
+            return redirect('admin_dashboard:order_list')
+        
+        if updated_ids:
+            messages.success(request, f'Đã cập nhật {len(updated_ids)} đơn hàng thành công')
+        else:
+            messages.warning(request, 'Không có đơn hàng nào được cập nhật')
+        
+        # Báo cáo các đơn bị bỏ qua, gom theo lý do
+        if skipped:
+            codes = dict(Order.objects.filter(pk__in=skipped).values_list('id', 'order_id'))
+            by_reason = {}
+            for order_id, reason in sorted(skipped.items()):
+                code = f'#{codes[order_id].hex[:8]}' if order_id in codes else f'ID {order_id}'
+                by_reason.setdefault(reason, []).append(code)
+            for reason, order_codes in by_reason.items():
+                messages.warning(request, f'Bỏ qua {len(order_codes)} đơn ({reason}): {", ".join(order_codes)}')
     
     return redirect('admin_dashboard:order_list')
 
+@login_required
+@user_passes_test(is_admin)
+def job_list(request):
+    """Danh sách công việc nền: mặc định là các job lỗi (dead-letter)"""
+    status = request.GET.get('status', Job.STATUS_DEAD)
+    if status not in dict(Job.STATUS_CHOICES):
+        status = Job.STATUS_DEAD
+    task_name = request.GET.get('task', '')
+    
+    jobs = Job.objects.filter(status=status)
+    if task_name:
+        jobs = jobs.filter(task=task_name)
+    
+    job_stats = {value: 0 for value, label in Job.STATUS_CHOICES}
+    for row in Job.objects.order_by().values('status').annotate(total=Count('id')):
+        job_stats[row['status']] = row['total']
+    
+    paginator = CursorPaginator(jobs, 20, ['-updated_at'], count=None if task_name else job_stats[status])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    
+    context = {
+        'page_obj': page_obj,
+        'status_choices': [(value, label, job_stats[value]) for value, label in Job.STATUS_CHOICES],
+        'selected_status': status,
+        'selected_task': task_name,
+        'task_names': Job.objects.order_by('task').values_list('task', flat=True).distinct(),
+        'job_stats': job_stats,
+    }
+    return render(request, 'admin_dashboard/job_list.html', context)
+
+@login_required
+@user_passes_test(is_admin)
+@require_POST
+def job_action(request):
+    """Chạy lại hoặc xóa các job dead-letter đã chọn"""
+    job_ids = request.POST.getlist('job_ids')
+    action = request.POST.get('action')
+    
+    if not job_ids:
+        messages.error(request, 'Vui lòng chọn ít nhất một công việc')
+        return redirect('admin_dashboard:job_list')
+    
+    jobs = Job.objects.filter(id__in=job_ids, status=Job.STATUS_DEAD)
+    if action == 'retry':
+        count = requeue(jobs)
+        messages.success(request, f'Đã đưa {count} công việc trở lại hàng đợi')
+    elif action == 'delete':
+        count, _ = jobs.delete()
+        messages.success(request, f'Đã xóa {count} công việc')
+    else:
+        messages.error(request, 'Thao tác không hợp lệ')
+    
+    return redirect('admin_dashboard:job_list')
+
 # Inventory Management Views
 @login_required
 @user_passes_test(is_admin)
@@ -675,7 +668,7 @@ def inventory_list(request):
     color = request.GET.get('color', '')
     stock_status = request.GET.get('stock_status', '')
     
-    inventory = ProductInventory.objects.select_related('product').order_by('product__name', 'color', 'size')
+    inventory = ProductInventory.objects.select_related('product')
     
     if query:
         inventory = inventory.filter(
@@ -701,9 +694,8 @@ def inventory_list(request):
     elif stock_status == 'in_stock':
         inventory = inventory.filter(quantity__gt=5)
     
-    paginator = Paginator(inventory, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(inventory, 20, ['product__name', 'color', 'size'])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     categories = Category.objects.all()
     
     # Get filter options
@@ -840,9 +832,15 @@ def inventory_edit(request, inventory_id):
     inventory = get_object_or_404(ProductInventory, id=inventory_id)
     
     if request.method == 'POST':
-        form = ProductInventoryForm(request.POST, instance=inventory)
+        with transaction.atomic():
+            # Khóa dòng tồn kho rồi mới đọc số lượng cũ: delta ghi sổ cái phải khớp với giá trị bị ghi đè
+            inventory = get_object_or_404(ProductInventory.objects.select_for_update(), id=inventory_id)
+            before = variant_quantities([inventory])
+            form = ProductInventoryForm(request.POST, instance=inventory)
+            if form.is_valid():
+                inventory = form.save()
+                record_movements(diff_movements(before, variant_quantities([inventory]), 'adjustment', actor=request.user))
         if form.is_valid():
-            inventory = form.save()
             messages.success(request, f'Đã cập nhật tồn kho cho {inventory.product.name} - {inventory.get_color_display()} - {inventory.size}')
             return redirect('admin_dashboard:inventory_list')
         else:
@@ -863,9 +861,14 @@ def inventory_edit(request, inventory_id):
 def inventory_delete(request, inventory_id):
     """Xóa tồn kho"""
     try:
-        inventory = get_object_or_404(ProductInventory, id=inventory_id)
-        inventory_info = f"{inventory.product.name} - {inventory.get_color_display()} - {inventory.size}"
-        inventory.delete()
+        with transaction.atomic():
+            # Khóa trước khi xóa để số lượng ghi sổ cái là số lượng thực bị xóa
+            inventory = get_object_or_404(ProductInventory.objects.select_for_update(), id=inventory_id)
+            inventory_info = f"{inventory.product.name} - {inventory.get_color_display()} - {inventory.size}"
+            inventory.delete()
+            record_movements([
+                movement(inventory.product_id, inventory.size, inventory.color, -inventory.quantity, 'removal', actor=request.user)
+            ])
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True, 'message': f'Đã xóa tồn kho {inventory_info}'})
@@ -900,54 +903,61 @@ def bulk_inventory(request):
             updated_count = 0
             error_count = 0
             errors = []
+            # Nhập thêm hàng ghi là 'import', đặt/giảm số lượng là 'adjustment'
+            reason = 'import' if operation == 'add' else 'adjustment'
+            moves = []
             
             try:
-                for size in sizes:
-                    for color in colors:
-                        try:
-                            # Try to get existing inventory first
-                            inventory = ProductInventory.objects.filter(
-                                product=product,
-                                size=size,
-                                color=color
-                            ).first()
-                            
-                            if inventory:
-                                # Update existing inventory based on operation
-                                if operation == 'set':
-                                    inventory.quantity = quantity
-                                elif operation == 'add':
-                                    inventory.quantity += quantity
-                                elif operation == 'subtract':
-                                    inventory.quantity = max(0, inventory.quantity - quantity)  # Không để âm
-                                
-                                inventory.save()
-                                updated_count += 1
-                            else:
-                                # Create new inventory (chỉ khi operation là 'set' hoặc 'add')
-                                if operation in ['set', 'add']:
-                                    # Generate unique SKU for new inventory
-                                    sku = generate_unique_sku(product, color, size)
+                with transaction.atomic():
+                    # Khóa các dòng tồn kho sẽ sửa để delta ghi sổ cái khớp đúng số lượng được ghi
+                    existing = {
+                        (item.size, item.color): item
+                        for item in ProductInventory.objects.filter(product=product, size__in=sizes, color__in=colors)
+                        .order_by('pk').select_for_update()
+                    }
+                    for size in sizes:
+                        for color in colors:
+                            try:
+                                # Savepoint: lỗi ở một biến thể không hủy các biến thể khác
+                                with transaction.atomic():
+                                    inventory = existing.get((size, color))
                                     
-                                    new_quantity = quantity if operation == 'set' else quantity
+                                    if inventory:
+                                        old_quantity = inventory.quantity
+                                        # Update existing inventory based on operation
+                                        if operation == 'set':
+                                            inventory.quantity = quantity
+                                        elif operation == 'add':
+                                            inventory.quantity += quantity
+                                        elif operation == 'subtract':
+                                            inventory.quantity = max(0, inventory.quantity - quantity)  # Không để âm
+                                        
+                                        inventory.save()
+                                        moves.append(movement(product.pk, size, color, inventory.quantity - old_quantity, reason, actor=request.user))
+                                        updated_count += 1
+                                    elif operation in ['set', 'add']:
+                                        # Create new inventory (chỉ khi operation là 'set' hoặc 'add')
+                                        inventory = ProductInventory.objects.create(
+                                            product=product,
+                                            size=size,
+                                            color=color,
+                                            quantity=quantity,
+                                            sku=generate_unique_sku(product, color, size)
+                                        )
+                                        moves.append(movement(product.pk, size, color, quantity, reason, actor=request.user))
+                                        created_count += 1
+                                    else:
+                                        # Không thể trừ từ inventory không tồn tại
+                                        errors.append(f"Không thể trừ từ {size}-{color}: không tồn tại trong kho")
+                                        error_count += 1
                                     
-                                    inventory = ProductInventory.objects.create(
-                                        product=product,
-                                        size=size,
-                                        color=color,
-                                        quantity=new_quantity,
-                                        sku=sku
-                                    )
-                                    created_count += 1
-                                else:
-                                    # Không thể trừ từ inventory không tồn tại
-                                    errors.append(f"Không thể trừ từ {size}-{color}: không tồn tại trong kho")
-                                    error_count += 1
-                                
-                        except Exception as e:
-                            error_count += 1
-                            errors.append(f"Lỗi với {size}-{color}: {str(e)}")
-                            continue
+                            except Exception as e:
+                                error_count += 1
+                                errors.append(f"Lỗi với {size}-{color}: {str(e)}")
+                                continue
+                    
+                    # Ghi sổ cái (và cộng dồn Product.stock) trong cùng transaction với các thay đổi tồn kho
+                    record_movements(moves)
                 
                 # Success message
                 operation_text = {
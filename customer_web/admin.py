@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db import transaction
 from .models import (
     Category, Product, ProductImage, ProductInventory, CustomerProfile, 
     Cart, CartItem, Order, OrderItem
 )
+from .stock import diff_movements, record_movements, variant_quantities
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -32,7 +34,30 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline, ProductInventoryInline]
-    list_editable = ['price', 'discount_price', 'stock', 'is_featured', 'is_active']
+    list_editable = ['price', 'discount_price', 'is_featured', 'is_active']
+    # stock là tổng tồn kho do sổ cái duy trì, chỉ sửa qua tồn kho của từng biến thể
+    readonly_fields = ['stock']
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Không ghi lại stock đọc lúc đầu request: giá trị được cộng dồn bằng UPDATE stock = stock + delta
+        # bởi các giao dịch tồn kho đồng thời (search_vector do Product.save tự cập nhật)
+        obj.save(update_fields=[
+            field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name not in ('stock', 'search_vector')
+        ])
+    
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not ProductInventory:
+            return super().save_formset(request, form, formset, change)
+        # Inline tồn kho: khóa các dòng hiện có, lưu rồi ghi sổ cái theo chênh lệch số lượng
+        product = form.instance
+        with transaction.atomic():
+            before = variant_quantities(ProductInventory.objects.filter(product=product).select_for_update())
+            super().save_formset(request, form, formset, change)
+            after = variant_quantities(ProductInventory.objects.filter(product=product))
+            record_movements(diff_movements(before, after, 'adjustment', actor=request.user))
 
 @admin.register(ProductInventory)
 class ProductInventoryAdmin(admin.ModelAdmin):
@@ -42,6 +67,28 @@ class ProductInventoryAdmin(admin.ModelAdmin):
     list_editable = ['quantity']
     readonly_fields = ['sku', 'created_at', 'updated_at']
     
+    # Mọi thay đổi số lượng (form, list_editable, xóa) đều ghi sổ cái StockMovement
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            before = {}
+            if change:
+                before = variant_quantities(ProductInventory.objects.filter(pk=obj.pk).select_for_update())
+            super().save_model(request, obj, form, change)
+            record_movements(diff_movements(before, variant_quantities([obj]), 'adjustment', actor=request.user))
+    
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            record_movements(diff_movements(variant_quantities([obj]), {}, 'removal', actor=request.user))
+    
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            # Queryset của changelist có thể có DISTINCT (lọc theo danh mục), không dùng được FOR UPDATE
+            queryset = ProductInventory.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+            before = variant_quantities(queryset.select_for_update())
+            super().delete_queryset(request, queryset)
+            record_movements(diff_movements(before, {}, 'removal', actor=request.user))
+    
     def is_in_stock(self, obj):
         return obj.is_in_stock
     is_in_stock.boolean = True
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CustomerWebConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'customer_web'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import tasks  # noqa: F401  (đăng ký các task của hàng đợi customer_web.jobs)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Product, ProductInventory, StockReservation
+
+# Snapshot tồn kho theo size x màu của từng sản phẩm, dùng chung cho trang chi tiết và API tồn kho.
+# quantity trong snapshot là số lượng còn bán được: tồn kho thực tế trừ các giữ hàng còn hiệu lực.
+# Entry bị xóa khi ProductInventory hoặc giữ hàng thay đổi (xem signals.py, reservations.py) và hết hạn
+# không muộn hơn lúc giữ hàng sớm nhất của sản phẩm hết hiệu lực; timeout còn lại chỉ là lưới an toàn.
+AVAILABILITY_CACHE_TIMEOUT = getattr(settings, 'INVENTORY_SNAPSHOT_CACHE_TIMEOUT', 60 * 60)
+
+
+def _cache_key(product_id):
+    return f'inventory_snapshot:{product_id}'
+
+def _make_snapshot(variants):
+    payload = json.dumps(variants, sort_keys=True)
+    return {
+        'variants': variants,
+        'etag': hashlib.md5(payload.encode()).hexdigest(),
+        'last_modified': timezone.now().replace(microsecond=0),
+    }
+
+def _read_variants(product_ids):
+    """
+    {product_id: [biến thể]} với quantity = số lượng còn bán được, và {product_id: lúc giữ hàng sớm nhất hết hạn}.
+    Hai truy vấn cho toàn bộ product_ids.
+    """
+    variants_by_product = {}
+    rows = (
+        ProductInventory.objects.filter(product_id__in=product_ids).with_available()
+        .order_by('product_id', 'size', 'color')
+        .values('product_id', 'size', 'color', 'available', 'sku')
+    )
+    for row in rows:
+        variants_by_product.setdefault(row['product_id'], []).append({
+            'size': row['size'],
+            'color': row['color'],
+            'quantity': max(0, row['available']),
+            'sku': row['sku'],
+        })
+    hold_expiry = dict(
+        StockReservation.objects.active().filter(inventory__product_id__in=product_ids)
+        .values('inventory__product_id').annotate(first=Min('expires_at'))
+        .values_list('inventory__product_id', 'first')
+    )
+    return variants_by_product, hold_expiry
+
+def _timeout(expires_at):
+    """Timeout cache của snapshot: hết hạn cùng lúc giữ hàng sớm nhất (nếu có) để số lượng được trả lại"""
+    if expires_at is None:
+        return AVAILABILITY_CACHE_TIMEOUT
+    return max(1, min(AVAILABILITY_CACHE_TIMEOUT, math.ceil((expires_at - timezone.now()).total_seconds())))
+
+def build_availability(product_id):
+    """Đọc tồn kho từ DB; trả về (snapshot, timeout cache) hoặc (None, None) nếu sản phẩm không tồn tại"""
+    variants_by_product, hold_expiry = _read_variants([product_id])
+    variants = variants_by_product.get(product_id, [])
+    if not variants and not Product.objects.filter(pk=product_id).exists():
+        return None, None
+    return _make_snapshot(variants), _timeout(hold_expiry.get(product_id))
+
+def get_availability(product_id):
+    """Snapshot tồn kho đã cache: {'variants': [...], 'etag': str, 'last_modified': datetime}"""
+    key = _cache_key(product_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot, timeout = build_availability(product_id)
+        if snapshot is not None:
+            cache.set(key, snapshot, timeout)
+    return snapshot
+
+def get_availability_many(product_ids):
+    """
+    Snapshot của nhiều sản phẩm: {product_id: snapshot}, bỏ qua id không tồn tại.
+    Các sản phẩm chưa có trong cache được đọc bằng một truy vấn ProductInventory duy nhất.
+    """
+    keys = {_cache_key(product_id): product_id for product_id in product_ids}
+    snapshots = {keys[key]: snapshot for key, snapshot in cache.get_many(keys).items()}
+    missing = [product_id for product_id in keys.values() if product_id not in snapshots]
+    if not missing:
+        return snapshots
+    
+    variants_by_product, hold_expiry = _read_variants(missing)
+    
+    # Sản phẩm không có biến thể nào: chỉ cache nếu sản phẩm thực sự tồn tại
+    without_variants = [product_id for product_id in missing if product_id not in variants_by_product]
+    if without_variants:
+        for product_id in Product.objects.filter(pk__in=without_variants).values_list('pk', flat=True):
+            variants_by_product[product_id] = []
+    
+    fresh = {product_id: _make_snapshot(variants) for product_id, variants in variants_by_product.items()}
+    # Sản phẩm đang có giữ hàng hết hạn sớm hơn nên được cache riêng với timeout ngắn hơn
+    cache.set_many(
+        {_cache_key(product_id): snapshot for product_id, snapshot in fresh.items() if product_id not in hold_expiry},
+        AVAILABILITY_CACHE_TIMEOUT,
+    )
+    for product_id, snapshot in fresh.items():
+        if product_id in hold_expiry:
+            cache.set(_cache_key(product_id), snapshot, _timeout(hold_expiry[product_id]))
+    snapshots.update(fresh)
+    return snapshots
+
+def invalidate_availability(product_id):
+    cache.delete(_cache_key(product_id))
+
+def invalidate_availability_many(product_ids):
+    for product_id in product_ids:
+        invalidate_availability(product_id)
+
+def find_variant(snapshot, size, color):
+    for variant in snapshot['variants']:
+        if variant['size'] == size and variant['color'] == color:
+            return variant
+    return None
@@ -0,0 +1,19 @@
+from django.core.cache import cache
+
+
+# Khóa phiên bản cache: tăng version để vô hiệu hóa toàn bộ các entry phụ thuộc mà không cần xóa từng key
+def get_version(name):
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+def bump_version(name):
+    key = f'version:{name}'
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+        return cache.incr(key)
@@ -0,0 +1,244 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, Sum, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from .models import Cart, CartItem, Product, CART_LINE_TOTAL, CART_UNIT_PRICE, primary_image_prefetch
+
+# Số lượng sản phẩm trong giỏ được lưu kèm trong session để badge giỏ hàng không cần truy vấn DB
+CART_TOTAL_SESSION_KEY = 'cart_total_items'
+
+# Giỏ hàng của khách nằm trong cookie đã ký, không tạo session hay dòng Cart/CartItem
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_SALT = 'customer_web.cart.guest'
+GUEST_CART_MAX_AGE = getattr(settings, 'GUEST_CART_MAX_AGE', 60 * 60 * 24 * 30)
+GUEST_CART_MAX_LINES = 50  # giữ cookie dưới giới hạn 4KB
+
+
+class GuestCart:
+    """
+    Giỏ hàng của khách chưa đăng nhập, lưu trong cookie đã ký.
+    Mỗi dòng là [id, product_id, size, color, quantity]; id chỉ dùng để sửa/xóa dòng từ trang giỏ hàng.
+    Chỉ được ghi vào Cart/CartItem khi thanh toán (materialize) hoặc khi đăng nhập (gộp vào giỏ tài khoản).
+    """
+    def __init__(self, lines=None):
+        self.lines = lines or []
+        self.modified = False
+
+    @classmethod
+    def from_request(cls, request):
+        raw = request.get_signed_cookie(GUEST_CART_COOKIE, default=None, salt=GUEST_CART_SALT, max_age=GUEST_CART_MAX_AGE)
+        lines = []
+        if raw:
+            try:
+                for line_id, product_id, size, color, quantity in json.loads(raw):
+                    lines.append([int(line_id), int(product_id), str(size), str(color), max(1, int(quantity))])
+            except (TypeError, ValueError):
+                lines = []
+        return cls(lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    @property
+    def total_quantity(self):
+        return sum(line[4] for line in self.lines)
+
+    def find(self, line_id):
+        for line in self.lines:
+            if line[0] == line_id:
+                return line
+        return None
+
+    def add(self, product_id, size, color, quantity):
+        self.modified = True
+        for line in self.lines:
+            if line[1:4] == [product_id, size, color]:
+                line[4] += quantity
+                return line
+        if len(self.lines) >= GUEST_CART_MAX_LINES:
+            raise ValueError(f'Giỏ hàng tối đa {GUEST_CART_MAX_LINES} sản phẩm, vui lòng đăng nhập để thêm tiếp')
+        line_id = max((line[0] for line in self.lines), default=0) + 1
+        line = [line_id, product_id, size, color, quantity]
+        self.lines.append(line)
+        return line
+
+    def set_quantity(self, line_id, quantity):
+        line = self.find(line_id)
+        if line is None:
+            return False
+        self.modified = True
+        if quantity > 0:
+            line[4] = quantity
+        else:
+            self.lines.remove(line)
+        return True
+
+    def remove(self, line_id):
+        return self.set_quantity(line_id, 0)
+
+    def clear(self):
+        self.modified = True
+        self.lines = []
+
+    def save(self, response):
+        """Ghi giỏ vào cookie của response (xóa cookie khi giỏ rỗng)"""
+        if not self.lines:
+            response.delete_cookie(GUEST_CART_COOKIE)
+        else:
+            response.set_signed_cookie(
+                GUEST_CART_COOKIE,
+                json.dumps(self.lines, separators=(',', ':'), ensure_ascii=False),
+                salt=GUEST_CART_SALT,
+                max_age=GUEST_CART_MAX_AGE,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def merge_into(self, cart):
+        """Gộp các dòng vào giỏ trong DB bằng một câu upsert (cộng dồn số lượng), bỏ qua sản phẩm không còn tồn tại"""
+        return cart.merge_lines(line[1:] for line in self.lines)
+
+    def materialize(self):
+        """Tạo Cart/CartItem tạm từ giỏ của khách (dùng khi thanh toán)"""
+        with transaction.atomic():
+            return self.merge_into(Cart.objects.create())
+
+def get_guest_cart(request):
+    """GuestCart của request, đọc cookie một lần và ghi nhớ trên request"""
+    guest_cart = getattr(request, '_guest_cart', None)
+    if guest_cart is None:
+        guest_cart = GuestCart.from_request(request)
+        request._guest_cart = guest_cart
+    return guest_cart
+
+
+class CartSummary:
+    """
+    Tổng quan giỏ hàng dùng chung trong một request (xem get_cart_summary).
+    Tổng số lượng/tiền tính bằng một truy vấn aggregate; các dòng được nạp kèm sản phẩm và ảnh đại diện.
+    """
+    def __init__(self, cart):
+        self.cart = cart
+
+    @cached_property
+    def _totals(self):
+        if self.cart is None:
+            return {'total_items': 0, 'total_price': 0}
+        return self.cart.items.aggregate(
+            total_items=Coalesce(Sum('quantity'), 0),
+            total_price=Coalesce(Sum(CART_LINE_TOTAL), 0, output_field=DecimalField()),
+        )
+
+    @cached_property
+    def items(self):
+        if self.cart is None:
+            return []
+        items = list(
+            self.cart.items.select_related('product')
+            .annotate(unit_price=CART_UNIT_PRICE, line_total=CART_LINE_TOTAL)
+            .order_by('id')
+        )
+        prefetch_related_objects(items, primary_image_prefetch('product__images'))
+        return items
+
+    @property
+    def total_items(self):
+        return self._totals['total_items']
+
+    @property
+    def total_price(self):
+        return self._totals['total_price']
+
+    def __bool__(self):
+        return bool(self.total_items)
+
+def claim_guest_cart(request, user, response, session_key=None):
+    """
+    Gộp giỏ của khách vào giỏ của user trong một transaction: các dòng trong cookie (một câu upsert)
+    và giỏ cũ lưu trong DB theo session_key (một câu upsert rồi xóa giỏ đó). Xóa cookie trên response.
+    Trả về giỏ của user, hoặc None nếu không có gì để gộp.
+    """
+    guest_cart = get_guest_cart(request)
+    legacy_cart = None
+    if session_key:
+        legacy_cart = Cart.objects.filter(session_key=session_key, user__isnull=True).first()
+    if not guest_cart.lines and legacy_cart is None:
+        return None
+    
+    with transaction.atomic():
+        user_cart, created = Cart.objects.get_or_create(user=user)
+        if guest_cart.lines:
+            guest_cart.merge_into(user_cart)
+        if legacy_cart is not None:
+            user_cart.absorb(legacy_cart)
+    
+    remember_cart_total(request, user_cart)
+    if guest_cart.lines:
+        guest_cart.clear()
+        guest_cart.save(response)
+    return user_cart
+
+class GuestCartSummary(CartSummary):
+    """CartSummary cho GuestCart: sản phẩm nạp bằng một truy vấn, tổng tính từ các dòng trong cookie"""
+    @cached_property
+    def _totals(self):
+        return {
+            'total_items': sum(item.quantity for item in self.items),
+            'total_price': sum(item.line_total for item in self.items),
+        }
+
+    @cached_property
+    def items(self):
+        product_ids = [line[1] for line in self.cart]
+        products = Product.objects.with_primary_image().in_bulk(product_ids) if product_ids else {}
+        items = []
+        for line_id, product_id, size, color, quantity in self.cart:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item = CartItem(id=line_id, product=product, size=size, color=color, quantity=quantity)
+            item.unit_price = product.get_price
+            item.line_total = item.unit_price * quantity
+            items.append(item)
+        return items
+
+def get_cart_summary(request, cart):
+    """CartSummary của giỏ hàng, ghi nhớ trên request để view, template và context processor dùng chung"""
+    summary = getattr(request, '_cart_summary', None)
+    if summary is None or summary.cart is not cart:
+        summary = GuestCartSummary(cart) if isinstance(cart, GuestCart) else CartSummary(cart)
+        request._cart_summary = summary
+    return summary
+
+def remember_cart_total(request, cart):
+    # Giỏ vừa thay đổi: bỏ CartSummary đã ghi nhớ và cập nhật badge trong session
+    request._cart_summary = None
+    request.session[CART_TOTAL_SESSION_KEY] = cart.total_quantity
+    return cart.total_quantity
+
+def forget_cart_total(request):
+    request._cart_summary = None
+    request.session.pop(CART_TOTAL_SESSION_KEY, None)
+
+def cart_total_for_request(request):
+    """Badge giỏ hàng: đọc từ CartSummary, cookie (khách) hoặc session; chỉ truy vấn bộ đếm của Cart khi chưa có"""
+    summary = getattr(request, '_cart_summary', None)
+    if summary is not None:
+        return summary.total_items
+    
+    if not request.user.is_authenticated:
+        # Khách: đọc từ cookie, không truy vấn và không tạo session
+        return get_guest_cart(request).total_quantity
+    
+    total = request.session.get(CART_TOTAL_SESSION_KEY)
+    if total is not None:
+        return total
+    
+    total = Cart.objects.filter(user=request.user).values_list('total_quantity', flat=True).first() or 0
+    request.session[CART_TOTAL_SESSION_KEY] = total
+    return total
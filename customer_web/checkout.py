@@ -0,0 +1,122 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .availability import invalidate_availability_many
+from .jobs import enqueue
+from .models import Order, OrderItem, ProductInventory, StockReservation
+from .reservations import release, variant_demand, variants_q
+from .stock import movement, record_movements
+
+
+# Khóa idempotency của các lần đặt hàng gần đây được cache (khóa -> order_id) để tra nhanh khi khách gửi lại form
+CHECKOUT_KEY_CACHE_TIMEOUT = getattr(settings, 'CHECKOUT_KEY_CACHE_TIMEOUT', 60 * 60 * 24)
+CHECKOUT_KEY_MAX_LENGTH = 64
+
+
+def new_checkout_key():
+    return uuid.uuid4().hex
+
+def _checkout_key_cache_key(key):
+    return f'checkout_key:{key}'
+
+def clean_checkout_key(key):
+    key = (key or '').strip()
+    return key if 0 < len(key) <= CHECKOUT_KEY_MAX_LENGTH else ''
+
+def find_order_for_key(key):
+    """order_id của đơn đã tạo với khóa này (cache trước, DB sau), hoặc None"""
+    if not key:
+        return None
+    order_id = cache.get(_checkout_key_cache_key(key))
+    if order_id is None:
+        order_id = Order.objects.filter(idempotency_key=key).values_list('order_id', flat=True).first()
+        if order_id is not None:
+            remember_checkout_key(key, order_id)
+    return order_id
+
+def remember_checkout_key(key, order_id):
+    cache.set(_checkout_key_cache_key(key), order_id, CHECKOUT_KEY_CACHE_TIMEOUT)
+
+class InsufficientStock(Exception):
+    """Không đủ tồn kho cho một hoặc nhiều dòng; shortages là danh sách chi tiết từng dòng thiếu"""
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__('Không đủ tồn kho')
+
+
+def _variant_q(product_id, size, color):
+    return Q(product_id=product_id, size=size, color=color)
+
+def _held_by_others(holder):
+    """Tổng giữ hàng còn hiệu lực của người khác trên dòng tồn kho đang xét (subquery)"""
+    held = StockReservation.objects.active().filter(inventory=OuterRef('pk'))
+    if holder:
+        held = held.exclude(holder=holder)
+    return Coalesce(Subquery(held.order_by().values('inventory').annotate(total=Sum('quantity')).values('total')), 0)
+
+def place_order(cart_summary, holder='', **order_fields):
+    """
+    Tạo đơn hàng từ CartSummary trong một transaction:
+    tạo Order, bulk_create OrderItem và trừ tồn kho bằng UPDATE có điều kiện
+    (quantity - giữ hàng của người khác >= số đặt), ghi sổ cái StockMovement rồi giải phóng giữ hàng của holder.
+    Các dòng tồn kho được cập nhật theo thứ tự (product_id, size, color) để các checkout đồng thời
+    luôn khóa theo cùng một thứ tự, tránh deadlock.
+    Nếu có dòng không đủ hàng, toàn bộ đơn bị rollback và InsufficientStock được raise.
+    order_fields có thể chứa idempotency_key; gửi trùng đồng thời sẽ gặp IntegrityError ngay khi tạo Order.
+    """
+    demand = variant_demand(cart_summary)
+    products = {item.product_id: item.product for item in cart_summary.items}
+    
+    with transaction.atomic():
+        order = Order.objects.create(total_amount=cart_summary.total_price, **order_fields)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                size=item.size,
+                color=item.color,
+                quantity=item.quantity,
+                price=item.unit_price,
+            )
+            for item in cart_summary.items
+        ])
+        
+        failed = []
+        for key in sorted(demand):
+            updated = ProductInventory.objects.filter(
+                _variant_q(*key), quantity__gte=_held_by_others(holder) + demand[key]
+            ).update(quantity=F('quantity') - demand[key])
+            if not updated:
+                failed.append(key)
+        
+        if failed:
+            available = {
+                (row['product_id'], row['size'], row['color']): row['available']
+                for row in ProductInventory.objects.filter(variants_q(failed)).with_available(holder)
+                .values('product_id', 'size', 'color', 'available')
+            }
+            raise InsufficientStock([
+                {
+                    'product': products[key[0]],
+                    'size': key[1],
+                    'color': key[2],
+                    'requested': demand[key],
+                    'available': max(0, available.get(key, 0)),
+                }
+                for key in failed
+            ])
+        
+        record_movements(
+            movement(*key, -demand[key], 'order', order=order, actor=order.user_id) for key in sorted(demand)
+        )
+        release(holder)
+        # Snapshot tồn kho xóa ngay sau commit; dựng lại card (nặng hơn) để worker làm
+        product_ids = sorted(products)
+        transaction.on_commit(lambda: invalidate_availability_many(product_ids))
+        enqueue('catalog.refresh_cards', product_ids=product_ids)
+    return order
@@ -1,18 +1,11 @@
-from customer_web.models import Cart
+from django.utils.functional import SimpleLazyObject
+
+from customer_web.cart import cart_total_for_request
+from customer_web.navigation import get_category_navigation
 
 def cart_total_items(request):
-    cart = None
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            pass
-    else:
-        session_key = request.session.session_key
-        if session_key:
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-            except Cart.DoesNotExist:
-                pass
-    total_items = cart.total_items if cart else 0
-    return {'cart_total_items': total_items}
+    return {'cart_total_items': cart_total_for_request(request)}
+
+def category_navigation(request):
+    # Lazy: chỉ đọc cache khi template thực sự dùng menu danh mục
+    return {'category_nav': SimpleLazyObject(get_category_navigation)}
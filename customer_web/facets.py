@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .caching import get_version
+from .models import ProductInventory
+
+# Khoảng giá tính trên giá thực bán (effective_price = giá khuyến mãi nếu có, ngược lại là giá gốc)
+PRICE_BUCKETS = [
+    ('under-100k', 'Dưới 100.000₫', None, 100000),
+    ('100k-200k', '100.000₫ - 200.000₫', 100000, 200000),
+    ('200k-500k', '200.000₫ - 500.000₫', 200000, 500000),
+    ('over-500k', 'Trên 500.000₫', 500000, None),
+]
+
+SIZE_OPTIONS = ProductInventory.SIZE_CHOICES
+COLOR_OPTIONS = ProductInventory.COLOR_CHOICES
+PRICE_OPTIONS = [(key, label) for key, label, low, high in PRICE_BUCKETS]
+
+FACET_CACHE_TIMEOUT = getattr(settings, 'CATALOG_FACET_CACHE_TIMEOUT', 300)
+
+
+def parse_filters(params):
+    """Chuẩn hóa bộ lọc từ query string: chỉ giữ giá trị hợp lệ, bỏ trùng và sắp xếp"""
+    def split(name, options=None):
+        values = {value.strip() for value in params.get(name, '').split(',') if value.strip()}
+        if options is not None:
+            values &= {value for value, label in options}
+        return sorted(values)
+    
+    return {
+        'categories': split('categories'),
+        'sizes': split('sizes', SIZE_OPTIONS),
+        'colors': split('colors', COLOR_OPTIONS),
+        'price': split('price', PRICE_OPTIONS),
+        'in_stock': params.get('in_stock') == '1',
+    }
+
+def price_bucket(price):
+    """Khóa khoảng giá chứa giá price"""
+    for key, label, low, high in PRICE_BUCKETS:
+        if (low is None or price >= low) and (high is None or price < high):
+            return key
+    return None
+
+def price_bucket_q(key):
+    for bucket_key, label, low, high in PRICE_BUCKETS:
+        if bucket_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(effective_price__gte=low)
+            if high is not None:
+                q &= Q(effective_price__lt=high)
+            return q
+    return Q()
+
+def facet_q(facet, values):
+    """Điều kiện lọc ProductCard cho một facet (OR giữa các giá trị trong cùng facet)"""
+    if facet == 'categories':
+        return Q(category_slugs__overlap=values)
+    if facet == 'sizes':
+        return Q(available_sizes__overlap=values)
+    if facet == 'colors':
+        return Q(available_colors__overlap=values)
+    if facet == 'price':
+        q = Q()
+        for key in values:
+            q |= price_bucket_q(key)
+        return q
+    if facet == 'in_stock':
+        return Q(in_stock=True)
+    return Q()
+
+def filters_q(filters, exclude=None):
+    """Kết hợp (AND) điều kiện của tất cả facet đang chọn, có thể bỏ qua một facet"""
+    q = Q()
+    for facet, values in filters.items():
+        if facet != exclude and values:
+            q &= facet_q(facet, values)
+    return q
+
+def _count(q):
+    return Count('pk', filter=q) if q else Count('pk')
+
+def facet_counts(queryset, filters, category_options, search_query=''):
+    """
+    Đếm số sản phẩm cho từng giá trị facet trong một truy vấn aggregate duy nhất.
+    Mỗi facet được đếm theo các facet còn lại (kiểu faceted navigation thông thường),
+    kết quả cache theo bộ lọc đã chuẩn hóa và version của catalog.
+    """
+    options = {
+        'categories': category_options,
+        'sizes': SIZE_OPTIONS,
+        'colors': COLOR_OPTIONS,
+        'price': PRICE_OPTIONS,
+    }
+    raw_key = json.dumps([filters, search_query or '', options['categories']], sort_keys=True)
+    cache_key = 'catalog_facets:%s:%s' % (
+        get_version('catalog'), hashlib.md5(raw_key.encode('utf-8')).hexdigest()
+    )
+    counts = cache.get(cache_key)
+    if counts is not None:
+        return counts
+    
+    aggregates = {'total': _count(filters_q(filters))}
+    for facet, facet_options in options.items():
+        others = filters_q(filters, exclude=facet)
+        for index, (value, label) in enumerate(facet_options):
+            aggregates[f'{facet}_{index}'] = _count(others & facet_q(facet, [value]))
+    aggregates['in_stock'] = _count(filters_q(filters, exclude='in_stock') & Q(in_stock=True))
+    row = queryset.aggregate(**aggregates)
+    
+    counts = {'total': row['total'], 'in_stock': row['in_stock']}
+    for facet, facet_options in options.items():
+        counts[facet] = [
+            {
+                'value': value,
+                'label': label,
+                'count': row[f'{facet}_{index}'],
+                'selected': value in filters[facet],
+            }
+            for index, (value, label) in enumerate(facet_options)
+        ]
+    cache.set(cache_key, counts, FACET_CACHE_TIMEOUT)
+    return counts
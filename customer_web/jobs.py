@@ -0,0 +1,94 @@
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+
+# Số lần chạy tối đa của một job trước khi chuyển sang dead-letter
+JOB_MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+# Backoff khi chạy lại: JOB_RETRY_BASE_DELAY * 2^(lần thử - 1) giây, tối đa JOB_RETRY_MAX_DELAY
+JOB_RETRY_BASE_DELAY = getattr(settings, 'JOB_RETRY_BASE_DELAY', 30)
+JOB_RETRY_MAX_DELAY = getattr(settings, 'JOB_RETRY_MAX_DELAY', 60 * 60)
+JOB_ERROR_MAX_LENGTH = 4000
+
+_tasks = {}
+
+
+def task(name):
+    """Đăng ký hàm xử lý cho job có tên name; hàm nhận payload dưới dạng keyword arguments"""
+    def decorator(func):
+        _tasks[name] = func
+        func.task_name = name
+        return func
+    return decorator
+
+def enqueue(name, delay=None, max_attempts=None, **payload):
+    """
+    Thêm job vào hàng đợi. Job được ghi trong transaction hiện tại nên worker chỉ thấy
+    job sau khi dữ liệu của view đã commit (và job mất theo nếu view rollback).
+    payload phải serialize được thành JSON.
+    """
+    if name not in _tasks:
+        raise ValueError(f'Chưa đăng ký task "{name}"')
+    run_after = timezone.now() + delay if delay else timezone.now()
+    return Job.objects.create(
+        task=name,
+        payload=payload,
+        run_after=run_after,
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+    )
+
+def retry_delay(attempts):
+    """Thời gian chờ trước lần chạy lại thứ attempts (exponential backoff kèm jitter)"""
+    delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def run_next_job():
+    """
+    Nhận và chạy một job đến hạn; trả về False nếu không còn job nào để chạy.
+    Job bị khóa (FOR UPDATE SKIP LOCKED) suốt lúc chạy, các worker khác bỏ qua nó thay vì chờ.
+    Hàm xử lý chạy trong savepoint cùng transaction với việc xóa job, nên thay đổi dữ liệu
+    của job thành công được commit đúng một lần; worker chết giữa chừng thì transaction
+    rollback và job tự quay lại hàng đợi.
+    """
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_QUEUED, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return False
+
+        handler = _tasks.get(job.task)
+        try:
+            if handler is None:
+                raise LookupError(f'Chưa đăng ký task "{job.task}"')
+            with transaction.atomic():
+                handler(**job.payload)
+        except Exception:
+            job.attempts += 1
+            job.last_error = traceback.format_exc()[-JOB_ERROR_MAX_LENGTH:]
+            if handler is None or job.attempts >= job.max_attempts:
+                job.status = Job.STATUS_DEAD
+            else:
+                job.run_after = timezone.now() + retry_delay(job.attempts)
+            job.save(update_fields=['attempts', 'last_error', 'status', 'run_after', 'updated_at'])
+        else:
+            job.delete()
+    return True
+
+def requeue(jobs):
+    """Đưa các job dead-letter trở lại hàng đợi (đặt lại số lần thử); trả về số job được đưa lại"""
+    return jobs.filter(status=Job.STATUS_DEAD).update(
+        status=Job.STATUS_QUEUED,
+        attempts=0,
+        run_after=timezone.now(),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,46 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from customer_web.models import StockMovement
+from customer_web.stock import compact_movements
+
+class Command(BaseCommand):
+    help = 'Fold old stock movements into per-variant snapshots so point-in-time stock queries stay cheap'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=getattr(settings, 'STOCK_MOVEMENT_RETENTION_DAYS', 90),
+            help='Compact movements older than this many days',
+        )
+        parser.add_argument('--step-days', type=int, default=1, help='Snapshot interval; each step runs in its own transaction')
+
+    def handle(self, *args, **options):
+        step = timedelta(days=max(1, options['step_days']))
+        today = timezone.localdate()
+        cutoff = timezone.make_aware(datetime.combine(today - timedelta(days=options['older_than_days']), time.min))
+
+        oldest = StockMovement.objects.filter(created_at__lt=cutoff).order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None:
+            self.stdout.write(self.style.SUCCESS('No stock movements to compact.'))
+            return
+
+        # Snapshot tại các mốc đầu ngày (theo step) từ biến động cũ nhất đến cutoff
+        boundary = timezone.make_aware(datetime.combine(timezone.localtime(oldest).date(), time.min)) + step
+        snapshots = compacted = 0
+        while True:
+            boundary = min(boundary, cutoff)
+            # Mốc snapshot bao gồm mọi biến động trước đầu ngày kế tiếp
+            step_snapshots, step_compacted = compact_movements(boundary - timedelta(microseconds=1))
+            snapshots += step_snapshots
+            compacted += step_compacted
+            if step_compacted:
+                self.stdout.write(f'Compacted {compacted} movements up to {boundary:%Y-%m-%d}...')
+            if boundary >= cutoff:
+                break
+            boundary += step
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully compacted {compacted} movements into {snapshots} snapshots.')
+        )
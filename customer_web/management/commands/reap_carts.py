@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from customer_web.models import Cart
+
+class Command(BaseCommand):
+    help = 'Delete guest carts whose session expired or which have been idle past the TTL (run alongside clearsessions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=getattr(settings, 'GUEST_CART_TTL_DAYS', 30),
+                            help='Delete guest carts not updated for this many days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of carts deleted per transaction')
+        parser.add_argument('--clear-sessions', action='store_true', help='Run clearsessions before reaping carts')
+
+    def handle(self, *args, **options):
+        if options['clear_sessions']:
+            self.stdout.write('Clearing expired sessions...')
+            call_command('clearsessions')
+        
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['ttl_days'])
+        stale = Q(updated_at__lt=cutoff)
+        if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.db':
+            # Giỏ theo session đã hết hạn hoặc đã bị xóa
+            live_session = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gt=now)
+            stale |= Q(session_key__isnull=False) & ~Exists(live_session)
+        carts = Cart.objects.filter(Q(user__isnull=True) & stale)
+        
+        deleted = 0
+        batch_size = options['batch_size']
+        while True:
+            # Xóa theo lô nhỏ để không giữ khóa lâu trên bảng giỏ hàng
+            cart_ids = list(carts.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not cart_ids:
+                break
+            with transaction.atomic():
+                Cart.objects.filter(pk__in=cart_ids).delete()  # CartItem bị xóa theo cascade
+            deleted += len(cart_ids)
+            self.stdout.write(f'Deleted {deleted} carts...')
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully deleted {deleted} expired guest carts.')
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from customer_web.models import ProductCard
+
+class Command(BaseCommand):
+    help = 'Rebuild the ProductCard read model used by listing pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of cards written per upsert')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding product cards...')
+        
+        refreshed = ProductCard.refresh(batch_size=options['batch_size'])
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {refreshed} product cards.')
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from customer_web.models import StockReservation
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of reservations deleted per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        released = 0
+        while True:
+            # Giữ hàng hết hạn không còn được tính vào tồn kho khả dụng; lệnh này chỉ dọn bảng
+            reservation_ids = list(
+                StockReservation.objects.expired().order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+            )
+            if not reservation_ids:
+                break
+            with transaction.atomic():
+                StockReservation.objects.filter(pk__in=reservation_ids).delete()
+            released += len(reservation_ids)
+            self.stdout.write(f'Released {released} reservations...')
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully released {released} expired reservations.')
+        )
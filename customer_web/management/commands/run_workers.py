@@ -0,0 +1,91 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from customer_web.jobs import run_next_job
+
+logger = logging.getLogger(__name__)
+
+
+def work(stop, poll_interval, burst):
+    """Vòng lặp của một worker: chạy job đến khi hàng đợi trống thì ngủ poll_interval giây"""
+    processed = 0
+    while not stop.is_set():
+        try:
+            if run_next_job():
+                processed += 1
+                continue
+        except DatabaseError:
+            # Mất kết nối DB: bỏ kết nối hỏng, thử lại ở vòng sau
+            logger.exception('Job worker lost its database connection')
+            connections.close_all()
+        except Exception:
+            # Lỗi ngoài hàm xử lý job (vd. callback on_commit sau khi job đã commit): ghi log, worker chạy tiếp
+            logger.exception('Job worker iteration failed')
+        if burst:
+            break
+        stop.wait(poll_interval)
+    connections.close_all()
+    return processed
+
+def _work_process(stop, poll_interval, burst):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # tiến trình cha điều phối việc dừng qua stop
+    work(stop, poll_interval, burst)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers that claim queued jobs with SELECT ... FOR UPDATE SKIP LOCKED'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'JOB_WORKER_PROCESSES', 2), help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty instead of polling')
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND']
+        if backend.endswith(('.LocMemCache', '.DummyCache')):
+            # Job vô hiệu cache (version, snapshot tồn kho) phải ghi vào cache mà web process đọc
+            raise CommandError(
+                f'run_workers needs a cache shared with the web processes, but the default cache is {backend}. '
+                'Set KIKI_CACHE_URL to a Redis or Memcached URL.'
+            )
+        processes = max(1, options['processes'])
+        poll_interval = options['poll_interval']
+        burst = options['burst']
+        # fork: tiến trình con kế thừa Django đã khởi tạo; kết nối DB phải đóng trước khi fork
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+        if processes == 1:
+            try:
+                processed = work(stop, poll_interval, burst)
+            except KeyboardInterrupt:
+                stop.set()
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Worker stopped after {processed} jobs.'))
+            return
+
+        connections.close_all()
+        workers = [
+            context.Process(target=_work_process, args=(stop, poll_interval, burst), name=f'job-worker-{index}')
+            for index in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {processes} workers.')
+
+        try:
+            while any(worker.is_alive() for worker in workers) and not stop.is_set():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+        self.stdout.write(self.style.SUCCESS(f'Stopped {processes} workers.'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from customer_web.stock import repair_stock, stock_drift
+
+class Command(BaseCommand):
+    help = 'Verify Product.stock against the sum of its inventory and optionally repair drifted products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite Product.stock for drifted products')
+
+    def handle(self, *args, **options):
+        drift = stock_drift()
+        for product_id, stock, total in drift:
+            self.stdout.write(f'Product {product_id}: stock={stock}, inventory total={total}')
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Product.stock matches inventory for all products.'))
+            return
+        if not options['repair']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} products drifted. Run with --repair to fix them.'))
+            return
+
+        repaired = repair_stock()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully repaired stock for {len(repaired)} products.')
+        )
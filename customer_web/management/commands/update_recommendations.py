@@ -0,0 +1,133 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from customer_web.models import Order, OrderItem, ProductRecommendation, RecommendationState, RecommendedOrder
+
+class Command(BaseCommand):
+    help = 'Incrementally update "frequently bought together" recommendations from new and cancelled orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of orders processed per transaction')
+        parser.add_argument('--rebuild', action='store_true', help='Drop all recommendations and reprocess every order')
+        parser.add_argument(
+            '--overlap-minutes', type=int, default=10,
+            help='Rescan orders updated this long before the last watermark to catch transactions that committed late',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        state, created = RecommendationState.objects.get_or_create(pk=1)
+
+        if options['rebuild']:
+            self.stdout.write('Clearing existing recommendations...')
+            with transaction.atomic():
+                ProductRecommendation.objects.all().delete()
+                RecommendedOrder.objects.all().delete()
+                state.last_updated_at = None
+                state.save()
+
+        # Quét lại một khoảng trước mốc: đơn có updated_at cũ hơn mốc nhưng commit muộn vẫn được xử lý.
+        # Quét trùng không sao vì mỗi đơn chỉ được cộng/trừ một lần theo bảng RecommendedOrder.
+        orders = Order.objects.order_by('updated_at', 'id')
+        if state.last_updated_at is not None:
+            orders = orders.filter(updated_at__gte=state.last_updated_at - timedelta(minutes=options['overlap_minutes']))
+
+        added = removed = 0
+        cursor_key = None
+        while True:
+            batch = orders
+            if cursor_key is not None:
+                updated_at, order_id = cursor_key
+                batch = batch.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=order_id))
+            rows = list(batch.values_list('updated_at', 'id')[:batch_size])
+            if not rows:
+                break
+
+            order_ids = [order_id for _, order_id in rows]
+            with transaction.atomic():
+                added += self.add_orders(order_ids)
+                removed += self.remove_cancelled_orders(order_ids)
+                cursor_key = rows[-1]
+                if state.last_updated_at is None or cursor_key[0] > state.last_updated_at:
+                    state.last_updated_at = cursor_key[0]
+                state.save()
+
+            self.stdout.write(f'Processed orders updated up to {cursor_key[0]:%Y-%m-%d %H:%M:%S}')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully added {added} orders and removed {removed} cancelled orders.')
+        )
+
+    def add_orders(self, order_ids):
+        """
+        Đánh dấu các đơn chưa hủy, chưa được tính trong order_ids rồi cộng các cặp sản phẩm mua cùng
+        của đúng những đơn vừa đánh dấu, trong một câu lệnh. Trả về số đơn đã cộng.
+        """
+        recommendation_table = ProductRecommendation._meta.db_table
+        counted_table = RecommendedOrder._meta.db_table
+        item_table = OrderItem._meta.db_table
+        order_table = Order._meta.db_table
+        sql = f"""
+            WITH added AS (
+                INSERT INTO {counted_table} (order_id, created_at)
+                SELECT o.id, NOW() FROM {order_table} o
+                WHERE o.id = ANY(%s) AND o.status <> 'cancelled'
+                ON CONFLICT (order_id) DO NOTHING
+                RETURNING order_id
+            ),
+            merged AS (
+                INSERT INTO {recommendation_table} (product_id, recommended_id, score, updated_at)
+                SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id), NOW()
+                FROM {item_table} a
+                JOIN {item_table} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+                WHERE a.order_id IN (SELECT order_id FROM added)
+                GROUP BY a.product_id, b.product_id
+                ON CONFLICT (product_id, recommended_id)
+                DO UPDATE SET score = {recommendation_table}.score + EXCLUDED.score, updated_at = EXCLUDED.updated_at
+            )
+            SELECT COUNT(*) FROM added
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [order_ids])
+            return cursor.fetchone()[0]
+
+    def remove_cancelled_orders(self, order_ids):
+        """
+        Trừ lại các cặp sản phẩm của những đơn đã được tính nhưng nay bị hủy (delta âm), bỏ đánh dấu
+        các đơn đó và xóa các cặp không còn đơn nào. Trả về số đơn đã trừ.
+        """
+        recommendation_table = ProductRecommendation._meta.db_table
+        counted_table = RecommendedOrder._meta.db_table
+        item_table = OrderItem._meta.db_table
+        order_table = Order._meta.db_table
+        sql = f"""
+            WITH removed AS (
+                DELETE FROM {counted_table} c
+                USING {order_table} o
+                WHERE c.order_id = o.id AND o.id = ANY(%s) AND o.status = 'cancelled'
+                RETURNING c.order_id
+            ),
+            pairs AS (
+                SELECT a.product_id, b.product_id AS recommended_id, COUNT(DISTINCT a.order_id) AS score
+                FROM {item_table} a
+                JOIN {item_table} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+                WHERE a.order_id IN (SELECT order_id FROM removed)
+                GROUP BY a.product_id, b.product_id
+            ),
+            updated AS (
+                UPDATE {recommendation_table} r
+                SET score = GREATEST(r.score - p.score, 0), updated_at = NOW()
+                FROM pairs p
+                WHERE r.product_id = p.product_id AND r.recommended_id = p.recommended_id
+                RETURNING r.id, r.score
+            )
+            SELECT (SELECT COUNT(*) FROM removed), ARRAY(SELECT id FROM updated WHERE score = 0)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [order_ids])
+            removed, empty_ids = cursor.fetchone()
+        if empty_ids:
+            ProductRecommendation.objects.filter(pk__in=empty_ids).delete()
+        return removed
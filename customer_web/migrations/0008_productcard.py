@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:14
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0007_order_cancel_reason_order_cancelled_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='customer_web.product')),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField()),
+                ('price', models.DecimalField(decimal_places=0, max_digits=10)),
+                ('discount_price', models.DecimalField(blank=True, decimal_places=0, max_digits=10, null=True)),
+                ('short_description', models.TextField(blank=True)),
+                ('image', models.ImageField(blank=True, upload_to='products/')),
+                ('category_slugs', django.contrib.postgres.fields.ArrayField(base_field=models.SlugField(), blank=True, default=list, size=None)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_featured', models.BooleanField(default=False)),
+                ('is_hot_trend', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Thẻ sản phẩm',
+                'verbose_name_plural': 'Thẻ sản phẩm',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['is_active', '-created_at'], name='customer_we_is_acti_e7c04d_idx'), models.Index(fields=['is_active', 'is_featured', '-created_at'], name='customer_we_is_acti_c05373_idx'), models.Index(fields=['is_active', 'is_hot_trend', '-created_at'], name='customer_we_is_acti_ccaaf9_idx'), models.Index(fields=['is_active', 'price'], name='customer_we_is_acti_bca863_idx'), models.Index(fields=['is_active', 'name'], name='customer_we_is_acti_7dddf9_idx'), django.contrib.postgres.indexes.GinIndex(fields=['category_slugs'], name='customer_we_categor_efc65c_gin')],
+            },
+        ),
+    ]
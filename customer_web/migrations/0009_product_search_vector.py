@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:15
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import UnaccentExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0008_productcard'),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='customer_we_search__63cfc4_gin'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE customer_web_product SET search_vector =
+                    setweight(to_tsvector('simple', unaccent(coalesce(name, ''))), 'A') ||
+                    setweight(to_tsvector('simple', unaccent(coalesce(description, ''))), 'B');
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
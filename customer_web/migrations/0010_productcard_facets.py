@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:19
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0009_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcard',
+            name='available_colors',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='available_sizes',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=5), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['is_active', 'effective_price'], name='customer_we_is_acti_1b3119_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['available_sizes'], name='customer_we_availab_01e8bb_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['available_colors'], name='customer_we_availab_96c175_gin'),
+        ),
+        migrations.RunSQL(
+            sql="UPDATE customer_web_productcard SET effective_price = COALESCE(NULLIF(discount_price, 0), price);",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
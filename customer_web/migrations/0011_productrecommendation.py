@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0010_productcard_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Trạng thái gợi ý sản phẩm',
+                'verbose_name_plural': 'Trạng thái gợi ý sản phẩm',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(default=0, help_text='Số đơn hàng có cả hai sản phẩm')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='customer_web.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_in', to='customer_web.product')),
+            ],
+            options={
+                'verbose_name': 'Gợi ý sản phẩm',
+                'verbose_name_plural': 'Gợi ý sản phẩm',
+                'indexes': [models.Index(fields=['product', '-score'], name='customer_we_product_814f29_idx')],
+                'unique_together': {('product', 'recommended')},
+            },
+        ),
+    ]
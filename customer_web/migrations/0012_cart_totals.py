@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0011_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE customer_web_cart c SET
+                    total_quantity = t.total_quantity,
+                    total_amount = t.total_amount
+                FROM (
+                    SELECT i.cart_id,
+                           SUM(i.quantity) AS total_quantity,
+                           SUM(i.quantity * COALESCE(NULLIF(p.discount_price, 0), p.price)) AS total_amount
+                    FROM customer_web_cartitem i
+                    JOIN customer_web_product p ON p.id = i.product_id
+                    GROUP BY i.cart_id
+                ) t
+                WHERE t.cart_id = c.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
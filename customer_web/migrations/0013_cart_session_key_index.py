@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0012_cart_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['updated_at'], name='cart_guest_updated_idx'),
+        ),
+    ]
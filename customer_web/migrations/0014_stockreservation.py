@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0013_cart_session_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(db_index=True, help_text='Người giữ hàng, vd. user:12 hoặc session:<key>', max_length=64)),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='customer_web.productinventory')),
+            ],
+            options={
+                'verbose_name': 'Giữ hàng',
+                'verbose_name_plural': 'Giữ hàng',
+                'indexes': [models.Index(fields=['inventory', 'expires_at'], name='customer_we_invento_a755fa_idx'), models.Index(fields=['expires_at'], name='customer_we_expires_7bf67c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0015_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Đang chờ'), ('dead', 'Lỗi (dead-letter)')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Công việc nền',
+                'verbose_name_plural': 'Công việc nền',
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['run_after', 'id'], name='job_queued_run_after_idx'), models.Index(fields=['status', '-updated_at'], name='job_status_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0016_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(max_length=5)),
+                ('color', models.CharField(max_length=20)),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('order', 'Đặt hàng'), ('cancel', 'Hủy đơn'), ('return', 'Hoàn trả'), ('adjustment', 'Điều chỉnh'), ('import', 'Nhập kho'), ('removal', 'Xóa biến thể')], max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='customer_web.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='customer_web.product')),
+            ],
+            options={
+                'verbose_name': 'Biến động tồn kho',
+                'verbose_name_plural': 'Biến động tồn kho',
+                'indexes': [models.Index(fields=['product', 'size', 'color', 'created_at'], name='stockmove_variant_time_idx'), models.Index(fields=['created_at'], name='stockmove_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(max_length=5)),
+                ('color', models.CharField(max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('as_of', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='customer_web.product')),
+            ],
+            options={
+                'verbose_name': 'Snapshot tồn kho',
+                'verbose_name_plural': 'Snapshot tồn kho',
+                'unique_together': {('product', 'size', 'color', 'as_of')},
+            },
+        ),
+        # Số dư đầu kỳ: tồn kho hiện tại làm snapshot đầu tiên của sổ cái
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO customer_web_stocksnapshot (product_id, size, color, quantity, as_of, created_at)
+                SELECT product_id, size, color, quantity, now(), now()
+                FROM customer_web_productinventory
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:41
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0017_stock_ledger'),
+    ]
+
+    operations = [
+        # Product.stock đã lệch qua các lần đặt/hủy đơn; đồng bộ một lần trước khi chuyển sang cập nhật theo delta
+        migrations.RunSQL(
+            sql="""
+                UPDATE customer_web_product p SET stock = t.total
+                FROM (
+                    SELECT p2.id, COALESCE(SUM(i.quantity), 0) AS total
+                    FROM customer_web_product p2
+                    LEFT JOIN customer_web_productinventory i ON i.product_id = p2.id
+                    GROUP BY p2.id
+                ) t
+                WHERE p.id = t.id AND p.stock <> t.total
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
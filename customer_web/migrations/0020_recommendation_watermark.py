@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0018_resync_product_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendedOrder',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='customer_web.order')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Đơn hàng đã tính gợi ý',
+                'verbose_name_plural': 'Đơn hàng đã tính gợi ý',
+            },
+        ),
+        migrations.AddField(
+            model_name='recommendationstate',
+            name='last_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Đơn đã được cộng theo mốc last_order_id cũ (trừ đơn đã hủy) được đánh dấu để không cộng lại;
+        # last_updated_at để trống nên lần chạy đầu quét lại mọi đơn và chỉ cộng các đơn chưa đánh dấu
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO customer_web_recommendedorder (order_id, created_at)
+                SELECT o.id, NOW()
+                FROM customer_web_order o, customer_web_recommendationstate s
+                WHERE s.id = 1 AND o.id <= s.last_order_id AND o.status <> 'cancelled'
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='recommendationstate',
+            name='last_order_id',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at', 'id'], name='customer_we_updated_acf837_idx'),
+        ),
+    ]
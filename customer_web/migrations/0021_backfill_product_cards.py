@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.utils.text import Truncator
+
+
+def backfill_product_cards(apps, schema_editor):
+    # Trang danh sách chỉ đọc ProductCard: dựng card cho các sản phẩm chưa có (như ProductCard.from_product,
+    # viết lại bằng model lịch sử của migration)
+    Product = apps.get_model('customer_web', 'Product')
+    ProductCard = apps.get_model('customer_web', 'ProductCard')
+    ProductImage = apps.get_model('customer_web', 'ProductImage')
+    ProductInventory = apps.get_model('customer_web', 'ProductInventory')
+    db = schema_editor.connection.alias
+
+    products = Product.objects.using(db).filter(card__isnull=True).prefetch_related('categories').order_by('pk')
+    cards = []
+    for product in products.iterator(chunk_size=500):
+        image = (
+            ProductImage.objects.using(db).filter(product=product)
+            .order_by('-is_primary', 'id').values_list('image', flat=True).first()
+        )
+        available = list(
+            ProductInventory.objects.using(db).filter(product=product, quantity__gt=0).values_list('size', 'color')
+        )
+        cards.append(ProductCard(
+            product=product,
+            name=product.name,
+            slug=product.slug,
+            price=product.price,
+            discount_price=product.discount_price,
+            effective_price=product.discount_price if product.discount_price else product.price,
+            short_description=Truncator(product.description).words(15),
+            image=image or '',
+            category_slugs=[category.slug for category in product.categories.all()],
+            available_sizes=sorted({size for size, color in available}),
+            available_colors=sorted({color for size, color in available}),
+            in_stock=bool(available),
+            is_active=product.is_active,
+            is_featured=product.is_featured,
+            is_hot_trend=product.is_hot_trend,
+            created_at=product.created_at,
+        ))
+        if len(cards) >= 500:
+            ProductCard.objects.using(db).bulk_create(cards, ignore_conflicts=True)
+            cards = []
+    if cards:
+        ProductCard.objects.using(db).bulk_create(cards, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_web', '0020_recommendation_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_product_cards, migrations.RunPython.noop),
+    ]
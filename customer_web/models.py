@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
 from django.utils import timezone
+from django.utils.text import Truncator
 import uuid
 
+from .caching import bump_version
+
 # Category model for fashion products
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name="Tên danh mục")
@@ -20,6 +27,44 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def primary_image_prefetch(lookup='images'):
+    """Prefetch chỉ một ảnh đại diện cho mỗi sản phẩm (ưu tiên is_primary, sau đó ảnh đầu tiên)"""
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by('product_id', '-is_primary', 'id').distinct('product_id'),
+        to_attr='primary_images',
+    )
+
+# Tìm kiếm full-text: bỏ dấu tiếng Việt bằng unaccent, tên sản phẩm có trọng số cao hơn mô tả
+SEARCH_CONFIG = 'simple'
+
+def unaccent(expression):
+    return models.Func(expression, function='unaccent', output_field=models.TextField())
+
+PRODUCT_SEARCH_VECTOR = (
+    SearchVector(unaccent(models.F('name')), weight='A', config=SEARCH_CONFIG) +
+    SearchVector(unaccent(models.F('description')), weight='B', config=SEARCH_CONFIG)
+)
+
+def product_search_query(text):
+    """Tạo tsquery đã bỏ dấu, ví dụ "ao khoac" sẽ khớp với "Áo khoác" """
+    return SearchQuery(unaccent(models.Value(text)), config=SEARCH_CONFIG)
+
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self):
+        """Lấy ảnh đại diện của cả trang sản phẩm trong một truy vấn"""
+        return self.prefetch_related(primary_image_prefetch())
+    
+    def search(self, text):
+        """Lọc theo search_vector (GIN index) và annotate rank để sắp xếp theo độ liên quan"""
+        query = product_search_query(text)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F('search_vector'), query)
+        )
+    
+    def update_search_vector(self):
+        return self.update(search_vector=PRODUCT_SEARCH_VECTOR)
+
 # Product model for Korean fashion items
 class Product(models.Model):
     SIZE_CHOICES = [
@@ -50,6 +95,7 @@ class Product(models.Model):
     description = models.TextField(verbose_name="Mô tả")
     price = models.DecimalField(max_digits=10, decimal_places=0, verbose_name="Giá")
     discount_price = models.DecimalField(max_digits=10, decimal_places=0, blank=True, null=True, verbose_name="Giá khuyến mãi")
+    # Tổng tồn kho các biến thể, cộng dồn theo delta khi ghi sổ cái (customer_web.stock.record_movements)
     stock = models.PositiveIntegerField(default=0, verbose_name="Số lượng tồn kho")
     sizes = models.CharField(max_length=50, help_text="Các size có sẵn, cách nhau bởi dấu phẩy")
     colors = models.CharField(max_length=100, help_text="Các màu có sẵn, cách nhau bởi dấu phẩy")
@@ -58,15 +104,28 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Kích hoạt")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    objects = ProductQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Sản phẩm"
         verbose_name_plural = "Sản phẩm"
         ordering = ['-created_at']
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
     
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Cập nhật vector tìm kiếm khi tên hoặc mô tả có thể đã thay đổi
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'description'} & set(update_fields):
+            Product.objects.filter(pk=self.pk).update_search_vector()
+    
     @property
     def get_price(self):
         return self.discount_price if self.discount_price else self.price
@@ -75,15 +134,17 @@ class Product(models.Model):
     def is_on_sale(self):
         return self.discount_price is not None
     
+    @property
+    def primary_image(self):
+        """Ảnh đại diện: dùng kết quả prefetch nếu có, nếu không thì truy vấn riêng"""
+        if hasattr(self, 'primary_images'):
+            return self.primary_images[0] if self.primary_images else None
+        return self.images.order_by('-is_primary', 'id').first()
+    
     @property
     def total_inventory_stock(self):
         """Tính tổng tồn kho từ các variant size/màu"""
         return self.inventory.aggregate(total=models.Sum('quantity'))['total'] or 0
-    
-    def update_stock_from_inventory(self):
-        """Cập nhật stock từ tổng inventory"""
-        self.stock = self.total_inventory_stock
-        self.save(update_fields=['stock'])
 
 # Product images
 class ProductImage(models.Model):
@@ -112,29 +173,153 @@ class CustomerProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.user.first_name} {self.user.last_name}"
 
+# Giá bán và thành tiền của một dòng giỏ hàng tính trong SQL (cùng quy tắc với Product.get_price)
+CART_UNIT_PRICE = Coalesce(
+    NullIf('product__discount_price', 0, output_field=models.DecimalField(max_digits=10, decimal_places=0)),
+    'product__price',
+)
+CART_LINE_TOTAL = models.ExpressionWrapper(
+    models.F('quantity') * CART_UNIT_PRICE, output_field=models.DecimalField(max_digits=12, decimal_places=0)
+)
+
 # Cart for logged-in users
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, blank=True, null=True)
-    session_key = models.CharField(max_length=50, blank=True, null=True)  # For guest users
+    session_key = models.CharField(max_length=50, blank=True, null=True, db_index=True)  # For guest users
+    # Bộ đếm denormalized, cập nhật bởi update_totals() sau mỗi thay đổi giỏ hàng
+    total_quantity = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=0, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = "Giỏ hàng"
         verbose_name_plural = "Giỏ hàng"
+        indexes = [
+            # Lệnh reap_carts tìm giỏ khách lâu không dùng
+            models.Index(fields=['updated_at'], condition=models.Q(user__isnull=True), name='cart_guest_updated_idx'),
+        ]
     
     def __str__(self):
         if self.user:
             return f"Giỏ hàng của {self.user.username}"
         return f"Giỏ hàng khách - {self.session_key}"
     
+    def update_totals(self):
+        """Tính lại bộ đếm từ các dòng trong giỏ bằng một câu UPDATE (an toàn khi nhiều request đồng thời)"""
+        items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+        Cart.objects.filter(pk=self.pk).update(
+            total_quantity=Coalesce(
+                models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')),
+                0,
+            ),
+            total_amount=Coalesce(
+                models.Subquery(items.annotate(total=models.Sum(CART_LINE_TOTAL)).values('total')),
+                0,
+                output_field=models.DecimalField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['total_quantity', 'total_amount', 'updated_at'])
+        return self.total_quantity
+    
+    def add_item(self, product_id, size, color, quantity, holder=''):
+        """
+        Thêm sản phẩm vào giỏ trong một câu lệnh SQL: kiểm tra tồn kho, upsert CartItem
+        (INSERT ... ON CONFLICT cộng dồn số lượng, không mất lượt thêm khi bấm liên tiếp)
+        và cộng bộ đếm của giỏ.
+        Tồn kho được tính là tồn kho khả dụng: trừ giữ hàng còn hiệu lực của người khác holder.
+        Trả về (tồn kho của biến thể hoặc None nếu không có, số lượng dòng sau khi thêm
+        hoặc None nếu vượt tồn kho, tổng số lượng của giỏ).
+        """
+        sql = f"""
+            WITH inventory AS (
+                SELECT i.quantity - COALESCE((
+                           SELECT SUM(r.quantity) FROM {StockReservation._meta.db_table} r
+                           WHERE r.inventory_id = i.id AND r.expires_at > NOW() AND r.holder <> %(holder)s
+                       ), 0) AS quantity,
+                       COALESCE(NULLIF(p.discount_price, 0), p.price) AS unit_price
+                FROM {ProductInventory._meta.db_table} i
+                JOIN {Product._meta.db_table} p ON p.id = i.product_id AND p.is_active
+                WHERE i.product_id = %(product)s AND i.size = %(size)s AND i.color = %(color)s
+            ),
+            line AS (
+                INSERT INTO {CartItem._meta.db_table} AS item (cart_id, product_id, size, color, quantity, added_at)
+                SELECT %(cart)s, %(product)s, %(size)s, %(color)s, %(quantity)s, NOW()
+                FROM inventory WHERE inventory.quantity >= %(quantity)s
+                ON CONFLICT (cart_id, product_id, size, color) DO UPDATE
+                    SET quantity = item.quantity + EXCLUDED.quantity
+                    WHERE item.quantity + EXCLUDED.quantity <= (SELECT quantity FROM inventory)
+                RETURNING item.quantity
+            ),
+            totals AS (
+                UPDATE {Cart._meta.db_table} SET
+                    total_quantity = total_quantity + %(quantity)s,
+                    total_amount = total_amount + %(quantity)s * (SELECT unit_price FROM inventory),
+                    updated_at = NOW()
+                WHERE id = %(cart)s AND EXISTS (SELECT 1 FROM line)
+                RETURNING total_quantity, total_amount
+            )
+            SELECT (SELECT quantity FROM inventory), (SELECT quantity FROM line),
+                   (SELECT total_quantity FROM totals), (SELECT total_amount FROM totals)
+        """
+        params = {
+            'cart': self.pk, 'product': product_id, 'size': size, 'color': color,
+            'quantity': quantity, 'holder': holder,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            stock, line_quantity, total_quantity, total_amount = cursor.fetchone()
+        if total_quantity is not None:
+            self.total_quantity = total_quantity
+            self.total_amount = total_amount
+        return stock, line_quantity, self.total_quantity
+    
+    def _merge_items(self, source_sql, params):
+        """Upsert các dòng (product_id, size, color, quantity) từ source_sql vào giỏ, cộng dồn số lượng khi trùng"""
+        sql = f"""
+            INSERT INTO {CartItem._meta.db_table} AS item (cart_id, product_id, size, color, quantity, added_at)
+            SELECT %s, source.product_id, source.size, source.color, SUM(source.quantity), NOW()
+            FROM ({source_sql}) AS source (product_id, size, color, quantity)
+            JOIN {Product._meta.db_table} p ON p.id = source.product_id
+            GROUP BY source.product_id, source.size, source.color
+            ON CONFLICT (cart_id, product_id, size, color) DO UPDATE
+                SET quantity = item.quantity + EXCLUDED.quantity
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.pk] + list(params))
+    
+    def merge_lines(self, lines):
+        """
+        Gộp các dòng (product_id, size, color, quantity) vào giỏ bằng một câu upsert trong transaction.
+        Bỏ qua sản phẩm không còn tồn tại. Dùng khi gộp giỏ khách (cookie) lúc đăng nhập hoặc thanh toán.
+        """
+        lines = [(int(product_id), size, color, int(quantity)) for product_id, size, color, quantity in lines]
+        with transaction.atomic():
+            if lines:
+                values = ', '.join(['(%s::integer, %s::varchar, %s::varchar, %s::integer)'] * len(lines))
+                self._merge_items(f'VALUES {values}', [value for line in lines for value in line])
+            self.update_totals()
+        return self
+    
+    def absorb(self, other):
+        """Chuyển toàn bộ dòng của giỏ other sang giỏ này (một câu upsert) rồi xóa giỏ other, trong một transaction"""
+        with transaction.atomic():
+            self._merge_items(
+                f'SELECT product_id, size, color, quantity FROM {CartItem._meta.db_table} WHERE cart_id = %s',
+                [other.pk],
+            )
+            other.delete()
+            self.update_totals()
+        return self
+    
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.total_quantity
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.items.aggregate(total=models.Sum(CART_LINE_TOTAL))['total'] or 0
 
 # Cart items
 class CartItem(models.Model):
@@ -155,6 +340,9 @@ class CartItem(models.Model):
     
     @property
     def total_price(self):
+        # Dùng thành tiền đã annotate sẵn (CartSummary) nếu có
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.product.get_price * self.quantity
 
 # Order model
@@ -189,6 +377,8 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, default='cod')
     total_amount = models.DecimalField(max_digits=10, decimal_places=0)
     notes = models.TextField(blank=True)
+    # Khóa chống gửi trùng form thanh toán (sinh khi mở trang checkout)
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
     
     # Thông tin hoàn trả
     return_reason = models.TextField(blank=True, verbose_name="Lý do hoàn trả")
@@ -209,6 +399,9 @@ class Order(models.Model):
         verbose_name = "Đơn hàng"
         verbose_name_plural = "Đơn hàng"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
     
     def __str__(self):
         return f"Đơn hàng #{self.order_id.hex[:8]} - {self.full_name}"
@@ -234,6 +427,51 @@ class OrderItem(models.Model):
         return self.price * self.quantity
 
 
+# Gợi ý "thường được mua cùng" - tính từ các sản phẩm xuất hiện chung trong một đơn hàng
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_in')
+    score = models.PositiveIntegerField(default=0, help_text="Số đơn hàng có cả hai sản phẩm")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Gợi ý sản phẩm"
+        verbose_name_plural = "Gợi ý sản phẩm"
+        unique_together = ('product', 'recommended')
+        indexes = [
+            models.Index(fields=['product', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.product} -> {self.recommended} ({self.score})"
+
+# Mốc updated_at của đơn hàng mà lệnh update_recommendations đã quét tới
+class RecommendationState(models.Model):
+    last_updated_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Trạng thái gợi ý sản phẩm"
+        verbose_name_plural = "Trạng thái gợi ý sản phẩm"
+
+# Đơn hàng đã được cộng vào ProductRecommendation (bị trừ lại và xóa khỏi bảng khi đơn bị hủy)
+class RecommendedOrder(models.Model):
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Đơn hàng đã tính gợi ý"
+        verbose_name_plural = "Đơn hàng đã tính gợi ý"
+
+class ProductInventoryQuerySet(models.QuerySet):
+    def with_available(self, exclude_holder=None):
+        """Annotate available = tồn kho thực tế trừ các giữ hàng còn hiệu lực (bỏ qua giữ hàng của exclude_holder)"""
+        held = StockReservation.objects.active().filter(inventory=models.OuterRef('pk'))
+        if exclude_holder:
+            held = held.exclude(holder=exclude_holder)
+        held = held.order_by().values('inventory').annotate(total=models.Sum('quantity')).values('total')
+        return self.annotate(available=models.F('quantity') - Coalesce(models.Subquery(held), 0))
+
 # Product Inventory - Quản lý tồn kho theo size và màu
 class ProductInventory(models.Model):
     SIZE_CHOICES = [
@@ -268,6 +506,8 @@ class ProductInventory(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductInventoryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Tồn kho sản phẩm"
         verbose_name_plural = "Tồn kho sản phẩm"
@@ -291,3 +531,282 @@ class ProductInventory(models.Model):
     @property
     def is_low_stock(self):
         return 0 < self.quantity <= 5
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+    
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+# Giữ hàng tạm thời trong lúc khách thanh toán, hết hiệu lực sau expires_at
+class StockReservation(models.Model):
+    inventory = models.ForeignKey(ProductInventory, on_delete=models.CASCADE, related_name='reservations')
+    holder = models.CharField(max_length=64, db_index=True, help_text="Người giữ hàng, vd. user:12 hoặc session:<key>")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = StockReservationQuerySet.as_manager()
+    
+    class Meta:
+        verbose_name = "Giữ hàng"
+        verbose_name_plural = "Giữ hàng"
+        indexes = [
+            # Tính tồn kho khả dụng: tổng giữ hàng còn hiệu lực của một dòng tồn kho
+            models.Index(fields=['inventory', 'expires_at']),
+            # Lệnh release_reservations xóa giữ hàng đã hết hạn
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.holder} giữ {self.quantity} x {self.inventory_id} đến {self.expires_at}"
+
+
+# Sổ cái biến động tồn kho (chỉ thêm, không sửa): mỗi thay đổi ProductInventory.quantity ghi một dòng delta.
+# Khóa theo (product, size, color) thay vì ProductInventory để lịch sử còn lại khi biến thể bị xóa/tạo lại.
+class StockMovement(models.Model):
+    REASON_CHOICES = [
+        ('order', 'Đặt hàng'),
+        ('cancel', 'Hủy đơn'),
+        ('return', 'Hoàn trả'),
+        ('adjustment', 'Điều chỉnh'),
+        ('import', 'Nhập kho'),
+        ('removal', 'Xóa biến thể'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    size = models.CharField(max_length=5)
+    color = models.CharField(max_length=20)
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    order = models.ForeignKey('Order', on_delete=models.SET_NULL, blank=True, null=True, related_name='stock_movements')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Biến động tồn kho"
+        verbose_name_plural = "Biến động tồn kho"
+        indexes = [
+            # Tồn kho tại một thời điểm: cộng các biến động của biến thể sau snapshot gần nhất
+            models.Index(fields=['product', 'size', 'color', 'created_at'], name='stockmove_variant_time_idx'),
+            # Lệnh compact_stock_movements quét các biến động cũ
+            models.Index(fields=['created_at'], name='stockmove_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.size}/{self.color} {self.delta:+d} ({self.get_reason_display()})"
+
+
+# Snapshot tồn kho của biến thể tại thời điểm as_of (đã cộng mọi biến động có created_at <= as_of).
+# Được tạo khi compact sổ cái và làm số dư đầu kỳ cho dữ liệu có trước sổ cái.
+class StockSnapshot(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    size = models.CharField(max_length=5)
+    color = models.CharField(max_length=20)
+    quantity = models.IntegerField()
+    as_of = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Snapshot tồn kho"
+        verbose_name_plural = "Snapshot tồn kho"
+        # Index của unique_together cũng phục vụ tìm snapshot gần nhất trước một thời điểm
+        unique_together = ('product', 'size', 'color', 'as_of')
+
+    def __str__(self):
+        return f"{self.product_id} {self.size}/{self.color} = {self.quantity} @ {self.as_of}"
+
+
+# Hàng đợi công việc nền (customer_web.jobs): worker nhận job bằng SELECT ... FOR UPDATE SKIP LOCKED.
+# Job chạy thành công bị xóa ngay nên bảng chỉ chứa job đang chờ và job lỗi (dead-letter).
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Đang chờ'),
+        (STATUS_DEAD, 'Lỗi (dead-letter)'),
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Công việc nền"
+        verbose_name_plural = "Công việc nền"
+        indexes = [
+            # Worker chỉ quét job đang chờ theo thứ tự đến hạn
+            models.Index(fields=['run_after', 'id'], condition=models.Q(status='queued'), name='job_queued_run_after_idx'),
+            # Trang dead-letter trong admin_dashboard
+            models.Index(fields=['status', '-updated_at'], name='job_status_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.get_status_display()})"
+
+
+class ProductCardQuerySet(models.QuerySet):
+    def search(self, text):
+        """Tìm kiếm full-text qua search_vector của Product (join theo khóa chính)"""
+        query = product_search_query(text)
+        # ts_rank trả về real; ép sang double precision để giá trị rank trong cursor phân trang so sánh chính xác
+        return self.filter(product__search_vector=query).annotate(
+            rank=Cast(SearchRank(models.F('product__search_vector'), query), models.FloatField())
+        )
+
+# Product card - bản chiếu gọn của Product dùng cho các trang danh sách
+class ProductCard(models.Model):
+    CARD_FIELDS = [
+        'name', 'slug', 'price', 'discount_price', 'effective_price', 'short_description', 'image',
+        'category_slugs', 'available_sizes', 'available_colors', 'in_stock',
+        'is_active', 'is_featured', 'is_hot_trend', 'created_at', 'updated_at',
+    ]
+    # Các field quyết định số đếm facet và menu danh mục (cache theo version 'catalog'); giá so theo khoảng giá
+    FACET_FIELDS = ['category_slugs', 'available_sizes', 'available_colors', 'in_stock', 'is_active']
+    
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    name = models.CharField(max_length=200)
+    slug = models.SlugField()
+    price = models.DecimalField(max_digits=10, decimal_places=0)
+    discount_price = models.DecimalField(max_digits=10, decimal_places=0, blank=True, null=True)
+    effective_price = models.DecimalField(max_digits=10, decimal_places=0)
+    short_description = models.TextField(blank=True)
+    image = models.ImageField(upload_to='products/', blank=True)
+    category_slugs = ArrayField(models.SlugField(), default=list, blank=True)
+    available_sizes = ArrayField(models.CharField(max_length=5), default=list, blank=True)
+    available_colors = ArrayField(models.CharField(max_length=20), default=list, blank=True)
+    in_stock = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
+    is_featured = models.BooleanField(default=False)
+    is_hot_trend = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = ProductCardQuerySet.as_manager()
+    
+    class Meta:
+        verbose_name = "Thẻ sản phẩm"
+        verbose_name_plural = "Thẻ sản phẩm"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', '-created_at']),
+            models.Index(fields=['is_active', 'is_featured', '-created_at']),
+            models.Index(fields=['is_active', 'is_hot_trend', '-created_at']),
+            models.Index(fields=['is_active', 'price']),
+            models.Index(fields=['is_active', 'effective_price']),
+            models.Index(fields=['is_active', 'name']),
+            GinIndex(fields=['category_slugs']),
+            GinIndex(fields=['available_sizes']),
+            GinIndex(fields=['available_colors']),
+        ]
+    
+    def __str__(self):
+        return self.name
+    
+    @property
+    def id(self):
+        # Giữ tương thích với template dùng product.id
+        return self.product_id
+    
+    @property
+    def get_price(self):
+        return self.effective_price
+    
+    @property
+    def is_on_sale(self):
+        return self.discount_price is not None
+    
+    @classmethod
+    def from_product(cls, product):
+        """Tạo card từ Product đã prefetch ảnh đại diện, danh mục và các biến thể còn hàng"""
+        primary_image = product.primary_image
+        available = product.available_inventory
+        return cls(
+            product=product,
+            name=product.name,
+            slug=product.slug,
+            price=product.price,
+            discount_price=product.discount_price,
+            effective_price=product.get_price,
+            short_description=Truncator(product.description).words(15),
+            image=primary_image.image.name if primary_image else '',
+            category_slugs=[category.slug for category in product.categories.all()],
+            available_sizes=sorted({item.size for item in available}),
+            available_colors=sorted({item.color for item in available}),
+            in_stock=bool(available),
+            is_active=product.is_active,
+            is_featured=product.is_featured,
+            is_hot_trend=product.is_hot_trend,
+            created_at=product.created_at,
+        )
+    
+    @classmethod
+    def refresh(cls, product_ids=None, batch_size=500):
+        """Dựng lại card cho các sản phẩm chỉ định (None = toàn bộ), ghi bằng bulk upsert"""
+        products = Product.objects.with_primary_image().prefetch_related(
+            'categories',
+            models.Prefetch(
+                'inventory',
+                queryset=ProductInventory.objects.filter(quantity__gt=0).only('product_id', 'size', 'color'),
+                to_attr='available_inventory',
+            ),
+        ).order_by('pk')
+        if product_ids is not None:
+            products = products.filter(pk__in=list(product_ids))
+        
+        refreshed = 0
+        facets_changed = False
+        cards = []
+        for product in products.iterator(chunk_size=batch_size):
+            cards.append(cls.from_product(product))
+            if len(cards) >= batch_size:
+                facets_changed |= cls._facets_changed(cards)
+                refreshed += cls._upsert(cards)
+                cards = []
+        if cards:
+            facets_changed |= cls._facets_changed(cards)
+            refreshed += cls._upsert(cards)
+        # Chỉ vô hiệu cache facet/menu khi card đổi giá trị ảnh hưởng tới chúng (vd. không phải mỗi lần đổi số lượng tồn)
+        if facets_changed:
+            bump_version('catalog')
+        return refreshed
+    
+    def facet_key(self):
+        """Bộ giá trị của card ảnh hưởng tới số đếm facet và menu danh mục"""
+        # facets import models nên import tại chỗ
+        from .facets import price_bucket
+        return (
+            tuple(sorted(self.category_slugs)),
+            tuple(sorted(self.available_sizes)),
+            tuple(sorted(self.available_colors)),
+            self.in_stock,
+            self.is_active,
+            price_bucket(self.effective_price),
+        )
+    
+    @classmethod
+    def _facets_changed(cls, cards):
+        """True nếu có card mới hoặc card có facet_key khác với bản đang lưu"""
+        stored = {
+            card.product_id: card.facet_key()
+            for card in cls.objects.filter(pk__in=[card.product_id for card in cards]).only(*cls.FACET_FIELDS, 'effective_price')
+        }
+        return any(stored.get(card.product_id) != card.facet_key() for card in cards)
+    
+    @classmethod
+    def _upsert(cls, cards):
+        cls.objects.bulk_create(
+            cards,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=cls.CARD_FIELDS,
+        )
+        return len(cards)
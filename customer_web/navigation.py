@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .caching import get_version
+from .models import Category
+
+# Dữ liệu menu danh mục kèm số sản phẩm, tính bằng một truy vấn GROUP BY và cache theo version 'catalog'
+# (version tăng khi danh mục thay đổi hoặc ProductCard được dựng lại với danh mục, size/màu còn hàng, trạng thái hay khoảng giá khác)
+NAVIGATION_CACHE_TIMEOUT = getattr(settings, 'CATEGORY_NAV_CACHE_TIMEOUT', 60 * 60)
+
+
+def build_category_navigation():
+    image_storage = Category._meta.get_field('image').storage
+    rows = (
+        Category.objects.filter(is_active=True)
+        .annotate(
+            product_count=Count('products', filter=Q(products__is_active=True), distinct=True),
+            in_stock_count=Count(
+                'products',
+                filter=Q(products__is_active=True, products__card__in_stock=True),
+                distinct=True,
+            ),
+        )
+        .order_by('name')
+        .values('slug', 'name', 'image', 'product_count', 'in_stock_count')
+    )
+    categories = []
+    for row in rows:
+        row['image'] = image_storage.url(row['image']) if row['image'] else ''
+        categories.append(row)
+    return categories
+
+def get_category_navigation():
+    """Danh sách danh mục đang hoạt động: slug, name, image (url), product_count, in_stock_count"""
+    key = f"category_nav:{get_version('catalog')}"
+    categories = cache.get(key)
+    if categories is None:
+        categories = build_category_navigation()
+        cache.set(key, categories, NAVIGATION_CACHE_TIMEOUT)
+    return categories
@@ -0,0 +1,214 @@
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import Order, OrderItem, Product, ProductInventory
+from .stock import generate_unique_sku, movement, record_movements
+
+
+class InvalidTransition(Exception):
+    """Không thể chuyển đơn hàng sang trạng thái yêu cầu (sai quy tắc hoặc đơn vừa bị đổi trạng thái)"""
+
+
+def restock_orders(order_ids, reason='cancel', actor=None):
+    """
+    Cộng lại tồn kho cho toàn bộ dòng của các đơn order_ids: số lượng được gộp theo biến thể
+    rồi áp dụng bằng một câu UPDATE ... FROM (VALUES ...). Biến thể đã bị xóa khỏi kho được tạo lại.
+    Mỗi cặp (đơn, biến thể) được ghi một dòng sổ cái với lý do reason.
+    Trả về danh sách product_id đã thay đổi tồn kho.
+    """
+    rows = list(
+        OrderItem.objects.filter(order_id__in=list(order_ids))
+        .order_by('product_id', 'size', 'color', 'order_id')
+        .values('order_id', 'product_id', 'size', 'color')
+        .annotate(total=Sum('quantity'))
+    )
+    if not rows:
+        return []
+    
+    totals = {}
+    for row in rows:
+        key = (row['product_id'], row['size'], row['color'])
+        totals[key] = totals.get(key, 0) + row['total']
+    lines = [key + (quantity,) for key, quantity in totals.items()]
+
+    values = ', '.join(['(%s::integer, %s::varchar, %s::varchar, %s::integer)'] * len(lines))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {ProductInventory._meta.db_table} AS inv
+            SET quantity = inv.quantity + v.quantity
+            FROM (VALUES {values}) AS v(product_id, size, color, quantity)
+            WHERE inv.product_id = v.product_id AND inv.size = v.size AND inv.color = v.color
+            RETURNING inv.product_id, inv.size, inv.color
+            """,
+            [value for line in lines for value in line],
+        )
+        updated = set(cursor.fetchall())
+
+    missing = [line for line in lines if line[:3] not in updated]
+    if missing:
+        products = Product.objects.in_bulk([line[0] for line in missing])
+        for product_id, size, color, quantity in missing:
+            product = products[product_id]
+            ProductInventory.objects.create(
+                product=product, size=size, color=color, quantity=quantity,
+                sku=generate_unique_sku(product, color, size),
+            )
+    
+    record_movements(
+        movement(row['product_id'], row['size'], row['color'], row['total'], reason, order=row['order_id'], actor=actor)
+        for row in rows
+    )
+    return sorted({key[0] for key in totals})
+
+
+class OrderStateMachine:
+    """
+    Nơi duy nhất đổi trạng thái đơn hàng: kiểm tra bước chuyển theo TRANSITIONS, ghi các mốc thời gian
+    và xếp job hoàn lại tồn kho khi hủy/hoàn trả. Trạng thái được ghi bằng UPDATE có điều kiện
+    status = trạng thái cũ nên hai yêu cầu đồng thời không thể cùng chuyển một đơn (và hoàn kho hai lần).
+    """
+    TRANSITIONS = {
+        'pending': ('confirmed', 'processing', 'cancelled'),
+        'confirmed': ('processing', 'shipping', 'cancelled'),
+        'processing': ('shipping', 'cancelled'),
+        'shipping': ('delivered',),
+        'delivered': ('return_requested',),
+        'return_requested': ('return_approved', 'returned', 'delivered'),
+        'return_approved': ('returned', 'refunded'),
+        'returned': ('refunded',),
+        'cancelled': (),
+        'refunded': (),
+    }
+    # Chuyển sang các trạng thái này từ trạng thái tương ứng thì hàng quay lại kho
+    RESTOCK_FROM = {
+        'cancelled': ('pending', 'confirmed', 'processing'),
+        'returned': ('return_requested', 'return_approved'),
+    }
+    # Lý do ghi vào sổ cái StockMovement khi hoàn kho
+    RESTOCK_REASONS = {'cancelled': 'cancel', 'returned': 'return'}
+    TIMESTAMP_FIELDS = {
+        'cancelled': 'cancelled_at',
+        'return_requested': 'return_requested_at',
+        'return_approved': 'return_approved_at',
+        'returned': 'return_completed_at',
+        'refunded': 'refund_completed_at',
+    }
+
+    def __init__(self, order):
+        self.order = order
+
+    @classmethod
+    def can_transition(cls, old_status, new_status):
+        return new_status in cls.TRANSITIONS.get(old_status, ())
+
+    @classmethod
+    def sources_for(cls, new_status):
+        """Các trạng thái được phép chuyển sang new_status"""
+        return [status for status, targets in cls.TRANSITIONS.items() if new_status in targets]
+
+    @classmethod
+    def restocks(cls, old_status, new_status):
+        return old_status in cls.RESTOCK_FROM.get(new_status, ())
+
+    @classmethod
+    def changes_for(cls, new_status, now=None):
+        """Các cột cần ghi khi chuyển sang new_status (dạng kwargs cho QuerySet.update)"""
+        now = now or timezone.now()
+        changes = {'status': new_status, 'updated_at': now}
+        if new_status in cls.TIMESTAMP_FIELDS:
+            changes[cls.TIMESTAMP_FIELDS[new_status]] = now
+        if new_status == 'refunded':
+            changes['refund_amount'] = Coalesce(F('refund_amount'), F('total_amount'))
+        return changes
+
+    @classmethod
+    def bulk_transition(cls, order_ids, new_status, actor=None):
+        """
+        Chuyển nhiều đơn sang new_status bằng một câu UPDATE ... WHERE id IN (...) AND status IN (...) RETURNING.
+        Đơn cần hoàn kho được gom vào một job orders.restock.
+        Trả về (danh sách id đã chuyển, dict id -> lý do bỏ qua).
+        """
+        order_ids = sorted({int(order_id) for order_id in order_ids})
+        sources = cls.sources_for(new_status)
+        if not order_ids:
+            return [], {}
+
+        table = Order._meta.db_table
+        column = lambda name: Order._meta.get_field(name).column
+        now = timezone.now()
+        assignments = [f'{column("status")} = %s', f'{column("updated_at")} = %s']
+        params = [new_status, now]
+        if new_status in cls.TIMESTAMP_FIELDS:
+            assignments.append(f'{column(cls.TIMESTAMP_FIELDS[new_status])} = %s')
+            params.append(now)
+        if new_status == 'refunded':
+            assignments.append(f'{column("refund_amount")} = COALESCE(o.{column("refund_amount")}, o.{column("total_amount")})')
+
+        with transaction.atomic():
+            moved = []
+            if sources:
+                with connection.cursor() as cursor:
+                    # Khóa các đơn theo thứ tự id trong subquery để lấy trạng thái cũ và tránh deadlock
+                    cursor.execute(
+                        f"""
+                        UPDATE {table} AS o
+                        SET {', '.join(assignments)}
+                        FROM (
+                            SELECT id, status FROM {table}
+                            WHERE id = ANY(%s) AND status = ANY(%s)
+                            ORDER BY id
+                            FOR UPDATE
+                        ) AS prev
+                        WHERE o.id = prev.id
+                        RETURNING o.id, prev.status
+                        """,
+                        params + [order_ids, sources],
+                    )
+                    moved = cursor.fetchall()
+
+            restock_ids = [order_id for order_id, old_status in moved if cls.restocks(old_status, new_status)]
+            if restock_ids:
+                enqueue('orders.restock', order_ids=sorted(restock_ids), reason=cls.RESTOCK_REASONS[new_status], actor_id=getattr(actor, 'pk', actor))
+
+        updated_ids = sorted(order_id for order_id, _ in moved)
+        skipped_ids = set(order_ids) - set(updated_ids)
+        skipped = {order_id: 'Không tìm thấy đơn hàng' for order_id in skipped_ids}
+        labels = dict(Order.STATUS_CHOICES)
+        for order_id, status in Order.objects.filter(pk__in=skipped_ids).values_list('id', 'status'):
+            if status == new_status:
+                skipped[order_id] = f'Đã ở trạng thái "{labels[new_status]}"'
+            else:
+                skipped[order_id] = f'Không thể chuyển từ "{labels.get(status, status)}" sang "{labels[new_status]}"'
+        return updated_ids, skipped
+
+    def allowed_transitions(self):
+        return self.TRANSITIONS.get(self.order.status, ())
+
+    def transition(self, new_status, actor=None, **fields):
+        """
+        Chuyển đơn sang new_status, ghi kèm fields (vd. cancel_reason, return_reason).
+        actor là người thực hiện, được ghi vào sổ cái tồn kho nếu bước chuyển hoàn kho.
+        Raise InvalidTransition nếu bước chuyển không hợp lệ hoặc đơn đã bị đổi trạng thái.
+        """
+        order = self.order
+        old_status = order.status
+        if not self.can_transition(old_status, new_status):
+            raise InvalidTransition(
+                f'Không thể chuyển đơn hàng từ "{order.get_status_display()}" sang "{dict(Order.STATUS_CHOICES).get(new_status, new_status)}"'
+            )
+
+        changes = self.changes_for(new_status)
+        changes.update(fields)
+        with transaction.atomic():
+            updated = Order.objects.filter(pk=order.pk, status=old_status).update(**changes)
+            if not updated:
+                raise InvalidTransition('Đơn hàng vừa được cập nhật bởi người khác, vui lòng tải lại')
+            if self.restocks(old_status, new_status):
+                enqueue('orders.restock', order_ids=[order.pk], reason=self.RESTOCK_REASONS[new_status], actor_id=getattr(actor, 'pk', actor))
+
+        order.refresh_from_db()
+        return order
@@ -0,0 +1,135 @@
+import datetime
+import math
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'customer_web.pagination.cursor'
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+class CursorPage:
+    """Một trang kết quả, giao diện gần giống django.core.paginator.Page"""
+    def __init__(self, object_list, paginator, number, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    """
+    Phân trang keyset (cursor) thay cho Paginator: không COUNT(*) và không OFFSET.
+
+    ordering là danh sách field sắp xếp (vd. ['-created_at'], ['price']); khóa chính luôn
+    được thêm vào cuối để thứ tự là duy nhất. Các field sắp xếp phải NOT NULL.
+    Cursor là token đã ký (opaque) chứa giá trị khóa của phần tử đầu/cuối trang.
+    Truyền count nếu tổng số đã có sẵn với chi phí thấp (vd. từ cache) để hiển thị số trang.
+    """
+    def __init__(self, queryset, per_page, ordering, count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count = count
+        self.fields = []
+        for field in list(ordering) + ['pk']:
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            if name == 'pk' and self.fields:
+                # Khóa chính đi cùng chiều với field sắp xếp chính
+                descending = self.fields[0][1]
+            self.fields.append((name, descending))
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def _order_by(self, reverse=False):
+        return [('-' if descending != reverse else '') + name for name, descending in self.fields]
+
+    def _seek(self, values, reverse=False):
+        """Điều kiện "đứng sau" bộ giá trị values theo thứ tự sắp xếp (hoặc đứng trước nếu reverse)"""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[index]})
+            for prev_index in range(index):
+                branch &= Q(**{self.fields[prev_index][0]: values[prev_index]})
+            condition |= branch
+        return condition
+
+    def _key(self, obj):
+        values = []
+        for name, _ in self.fields:
+            value = obj
+            for attr in name.split('__'):  # hỗ trợ field quan hệ, vd. product__name
+                value = getattr(value, attr)
+            values.append(_encode_value(value))
+        return values
+
+    def _make_cursor(self, obj, direction, number):
+        return signing.dumps({'v': self._key(obj), 'd': direction, 'p': number}, salt=CURSOR_SALT, compress=True)
+
+    def _parse_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(data, dict) or len(data.get('v') or []) != len(self.fields):
+            return None
+        return data
+
+    def get_page(self, cursor=None):
+        """Lấy trang theo cursor; cursor rỗng hoặc không hợp lệ trả về trang đầu"""
+        data = self._parse_cursor(cursor)
+        backwards = bool(data) and data.get('d') == 'prev'
+
+        queryset = self.queryset.order_by(*self._order_by(reverse=backwards))
+        if data:
+            queryset = queryset.filter(self._seek(data['v'], reverse=backwards))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            number = max(1, int(data.get('p') or 1))
+            has_next, has_previous = True, has_more
+        else:
+            number = int(data.get('p') or 1) if data else 1
+            has_next, has_previous = has_more, bool(data)
+
+        next_cursor = self._make_cursor(rows[-1], 'next', number + 1) if has_next and rows else None
+        previous_cursor = self._make_cursor(rows[0], 'prev', number - 1) if has_previous and rows else None
+        return CursorPage(rows, self, number, has_next, has_previous, next_cursor, previous_cursor)
@@ -0,0 +1,134 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .availability import invalidate_availability_many
+from .models import ProductInventory, StockReservation
+
+# Thời gian giữ hàng khi khách mở trang thanh toán (giây)
+RESERVATION_TTL = getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+
+
+def reservation_holder(request, create=False):
+    """Định danh người giữ hàng: user:<id> khi đã đăng nhập, session:<key> với khách (tạo session nếu create)"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if not request.session.session_key:
+        if not create:
+            return ''
+        request.session.save()
+    return f'session:{request.session.session_key}'
+
+def variant_demand(cart_summary):
+    """Số lượng cần theo biến thể (product_id, size, color) của các dòng trong giỏ"""
+    demand = {}
+    for item in cart_summary.items:
+        key = (item.product_id, item.size, item.color)
+        demand[key] = demand.get(key, 0) + item.quantity
+    return demand
+
+def variants_q(keys):
+    condition = Q()
+    for product_id, size, color in keys:
+        condition |= Q(product_id=product_id, size=size, color=color)
+    return condition
+
+def held_quantities(holder):
+    """{(product_id, size, color): số lượng} đang được holder giữ (chỉ giữ hàng còn hiệu lực)"""
+    held = {}
+    rows = StockReservation.objects.active().filter(holder=holder).values_list(
+        'inventory__product_id', 'inventory__size', 'inventory__color', 'quantity'
+    )
+    for product_id, size, color, quantity in rows:
+        key = (product_id, size, color)
+        held[key] = held.get(key, 0) + quantity
+    return held
+
+def reserve_for_checkout(holder, cart_summary):
+    """
+    Giữ hàng cho toàn bộ giỏ trong RESERVATION_TTL giây.
+    Giữ hàng còn hiệu lực của holder được dùng lại (không gia hạn): nếu đã khớp với giỏ thì không ghi gì,
+    ngược lại chỉ thêm/sửa/xóa các dòng giữ hàng của biến thể thay đổi. Các dòng tồn kho được khóa theo
+    thứ tự cố định trước khi tính tồn kho khả dụng, nên hai khách không thể cùng giữ một sản phẩm cuối cùng.
+    Trả về danh sách dòng không giữ đủ: {'key', 'requested', 'available'}.
+    """
+    demand = variant_demand(cart_summary)
+    if not demand:
+        release(holder)
+        return []
+    # Tải lại trang thanh toán với giỏ không đổi: dùng lại giữ hàng hiện có
+    if held_quantities(holder) == demand:
+        return []
+    
+    shortages = []
+    with transaction.atomic():
+        # Khóa trước, đọc tồn kho khả dụng bằng truy vấn sau để thấy giữ hàng của các transaction vừa commit
+        locked = list(
+            ProductInventory.objects.select_for_update()
+            .filter(variants_q(demand))
+            .order_by('product_id', 'size', 'color')
+            .values_list('pk', flat=True)
+        )
+        rows = ProductInventory.objects.filter(pk__in=locked).with_available(exclude_holder=holder)
+        available = {(row.product_id, row.size, row.color): row for row in rows}
+        
+        now = timezone.now()
+        current = {}
+        stale = []
+        touched = set()
+        for reservation in StockReservation.objects.filter(holder=holder).select_related('inventory').order_by('-expires_at'):
+            inventory = reservation.inventory
+            key = (inventory.product_id, inventory.size, inventory.color)
+            if key in current or key not in demand or reservation.expires_at <= now:
+                stale.append(reservation.pk)
+                touched.add(inventory.product_id)
+            else:
+                current[key] = reservation
+        
+        expires_at = now + timedelta(seconds=RESERVATION_TTL)
+        created = []
+        changed = []
+        for key, requested in sorted(demand.items()):
+            row = available.get(key)
+            can_hold = min(requested, max(0, row.available)) if row else 0
+            reservation = current.get(key)
+            if reservation is None:
+                if can_hold:
+                    created.append(StockReservation(
+                        inventory=row, holder=holder, quantity=can_hold, expires_at=expires_at
+                    ))
+            elif not can_hold:
+                stale.append(reservation.pk)
+                touched.add(key[0])
+            elif reservation.quantity != can_hold:
+                reservation.quantity = can_hold
+                changed.append(reservation)
+            if can_hold < requested:
+                shortages.append({'key': key, 'requested': requested, 'available': can_hold})
+        
+        if stale:
+            StockReservation.objects.filter(pk__in=stale).delete()
+        if changed:
+            StockReservation.objects.bulk_update(changed, ['quantity'])
+        StockReservation.objects.bulk_create(created)
+        
+        # Snapshot tồn kho hiển thị số lượng đã trừ giữ hàng: xóa snapshot của các sản phẩm có giữ hàng thay đổi
+        touched.update(item.inventory.product_id for item in changed)
+        touched.update(item.inventory.product_id for item in created)
+        if touched:
+            product_ids = sorted(touched)
+            transaction.on_commit(lambda: invalidate_availability_many(product_ids))
+    return shortages
+
+def release(holder):
+    """Xóa mọi giữ hàng của holder; snapshot tồn kho của các sản phẩm liên quan bị xóa sau commit"""
+    if not holder:
+        return
+    held = StockReservation.objects.filter(holder=holder)
+    product_ids = sorted(set(held.values_list('inventory__product_id', flat=True)))
+    if product_ids:
+        held.delete()
+        transaction.on_commit(lambda: invalidate_availability_many(product_ids))
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Category, Product, ProductImage, ProductInventory, ProductCard
+from .caching import bump_version
+from .availability import invalidate_availability
+from admin_dashboard.models import News
+
+
+def refresh_cards_on_commit(product_ids):
+    """
+    Dựng lại card sau khi transaction hiện tại commit (tránh ghi card cho sản phẩm đang bị xóa).
+    Id được gom theo kết nối DB: callback đầu tiên chạy sau commit dựng lại mọi sản phẩm đã gom một lần,
+    các callback sau của cùng transaction (vd. lưu sản phẩm kèm N biến thể) không còn gì để làm.
+    Id gom từ transaction bị rollback sẽ được dựng lại ở lần commit kế tiếp (thừa nhưng vô hại).
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, '_pending_card_refresh', None)
+    if pending is None:
+        pending = connection._pending_card_refresh = set()
+    pending.update(product_ids)
+    transaction.on_commit(lambda: flush_card_refresh(connection))
+
+def flush_card_refresh(connection):
+    pending = connection._pending_card_refresh
+    if pending:
+        product_ids = sorted(pending)
+        pending.clear()
+        ProductCard.refresh(product_ids)
+
+# Đồng bộ ProductCard mỗi khi dữ liệu hiển thị trên card thay đổi
+@receiver(post_save, sender=Product)
+def refresh_card_on_product_save(sender, instance, **kwargs):
+    refresh_cards_on_commit([instance.pk])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_delete, sender=ProductInventory)
+def refresh_card_on_related_change(sender, instance, **kwargs):
+    refresh_cards_on_commit([instance.product_id])
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def refresh_card_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Category.products.clear() không gửi pk_set, cần ghi nhớ trước khi xóa
+        instance._card_product_ids = list(instance.products.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        product_ids = pk_set if pk_set is not None else getattr(instance, '_card_product_ids', [])
+    else:
+        product_ids = [instance.pk]
+    refresh_cards_on_commit(product_ids)
+
+@receiver(post_delete, sender=Product)
+def bump_catalog_on_product_delete(sender, **kwargs):
+    # Card bị xóa theo cascade, không qua refresh nên cần tự vô hiệu các cache theo version 'catalog'
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+@receiver(post_save, sender=Category)
+def refresh_cards_on_category_save(sender, instance, **kwargs):
+    refresh_cards_on_commit(instance.products.values_list('pk', flat=True))
+    # Tên, ảnh, trạng thái của danh mục nằm trong menu và lựa chọn facet dù card không đổi
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._card_product_ids = list(instance.products.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Category)
+def refresh_cards_on_category_delete(sender, instance, **kwargs):
+    refresh_cards_on_commit(getattr(instance, '_card_product_ids', []))
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+# Xóa snapshot tồn kho của sản phẩm sau khi thay đổi tồn kho được commit
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_delete, sender=ProductInventory)
+def invalidate_availability_on_inventory_change(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_availability(product_id))
+
+# Vô hiệu fragment cache trang chủ (đăng ký sau các handler card để chạy sau khi card đã được dựng lại)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def bump_home_version(sender, update_fields=None, **kwargs):
+    # Lưu chỉ lượt xem không đổi nội dung hiển thị
+    if update_fields is not None and set(update_fields) <= {'views'}:
+        return
+    transaction.on_commit(lambda: bump_version('home'))
@@ -0,0 +1,171 @@
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Product, ProductInventory, StockMovement, StockSnapshot
+
+
+def movement(product_id, size, color, delta, reason, order=None, actor=None):
+    """Tạo (chưa lưu) một dòng sổ cái; order/actor có thể là object hoặc id (AnonymousUser -> không có actor)"""
+    return StockMovement(
+        product_id=product_id,
+        size=size,
+        color=color,
+        delta=delta,
+        reason=reason,
+        order_id=getattr(order, 'pk', order),
+        actor_id=getattr(actor, 'pk', actor),
+    )
+
+def record_movements(movements):
+    """
+    Ghi các biến động khác 0 vào sổ cái bằng một câu bulk INSERT và cộng dồn delta vào Product.stock.
+    Gọi trong cùng transaction với thay đổi ProductInventory.quantity tương ứng.
+    """
+    movements = [item for item in movements if item.delta]
+    if movements:
+        StockMovement.objects.bulk_create(movements)
+        apply_stock_deltas(movements)
+    return len(movements)
+
+def apply_stock_deltas(movements):
+    """
+    Cập nhật Product.stock theo tổng delta của từng sản phẩm bằng UPDATE stock = stock + delta,
+    thay vì tính lại SUM(quantity) trên toàn bộ tồn kho. Sản phẩm được cập nhật theo thứ tự id
+    để tránh deadlock; giá trị bị chặn dưới ở 0 (lệch nếu có sẽ được lệnh sync_product_stock sửa).
+    """
+    totals = {}
+    for item in movements:
+        totals[item.product_id] = totals.get(item.product_id, 0) + item.delta
+    for product_id, delta in sorted(totals.items()):
+        if delta:
+            Product.objects.filter(pk=product_id).update(stock=Greatest(F('stock') + delta, 0))
+
+def generate_unique_sku(product, color, size):
+    """Generate unique SKU for inventory item"""
+    base_sku = f"{slugify(product.name)}-{slugify(color)}-{size}"
+    sku = base_sku
+    counter = 1
+    
+    # Ensure SKU is unique across all products
+    while ProductInventory.objects.filter(sku=sku).exists():
+        sku = f"{base_sku}-{counter}"
+        counter += 1
+    
+    return sku
+
+def variant_quantities(inventories):
+    """{(product_id, size, color): quantity} của các dòng tồn kho, dùng để tính delta khi ghi đè số lượng"""
+    return {(item.product_id, item.size, item.color): item.quantity for item in inventories}
+
+def diff_movements(before, after, reason, actor=None):
+    """Biến động cho các biến thể có số lượng thay đổi giữa hai bảng {(product_id, size, color): quantity}"""
+    return [
+        movement(*key, after.get(key, 0) - before.get(key, 0), reason, actor=actor)
+        for key in sorted(set(before) | set(after))
+    ]
+
+def stock_at(product_id, size, color, when):
+    """
+    Tồn kho của biến thể tại thời điểm when: snapshot gần nhất trước when cộng các biến động sau snapshot.
+    Cả hai bước đều là tìm kiếm theo index (product, size, color, thời gian), số biến động phải cộng
+    bị chặn bởi chu kỳ compact nên chi phí không tăng theo độ dài sổ cái.
+    """
+    snapshot = (
+        StockSnapshot.objects.filter(product_id=product_id, size=size, color=color, as_of__lte=when)
+        .order_by('-as_of')
+        .values_list('as_of', 'quantity')
+        .first()
+    )
+    movements = StockMovement.objects.filter(product_id=product_id, size=size, color=color, created_at__lte=when)
+    base = 0
+    if snapshot:
+        movements = movements.filter(created_at__gt=snapshot[0])
+        base = snapshot[1]
+    return base + (movements.aggregate(total=Sum('delta'))['total'] or 0)
+
+def compact_movements(before):
+    """
+    Gộp mọi biến động có created_at <= before thành snapshot tại before (snapshot trước đó + tổng delta)
+    rồi xóa chúng, trong một câu lệnh. Trả về (số biến thể được snapshot, số biến động đã gộp).
+    """
+    movement_table = StockMovement._meta.db_table
+    snapshot_table = StockSnapshot._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {movement_table} WHERE created_at <= %(before)s
+                RETURNING product_id, size, color, delta
+            ),
+            summed AS (
+                SELECT product_id, size, color, SUM(delta) AS total, COUNT(*) AS moves
+                FROM moved GROUP BY product_id, size, color
+            ),
+            inserted AS (
+                INSERT INTO {snapshot_table} (product_id, size, color, quantity, as_of, created_at)
+                SELECT s.product_id, s.size, s.color,
+                       COALESCE((
+                           SELECT p.quantity FROM {snapshot_table} p
+                           WHERE p.product_id = s.product_id AND p.size = s.size AND p.color = s.color
+                             AND p.as_of <= %(before)s
+                           ORDER BY p.as_of DESC LIMIT 1
+                       ), 0) + s.total,
+                       %(before)s, %(now)s
+                FROM summed s
+                ON CONFLICT (product_id, size, color, as_of) DO UPDATE SET quantity = EXCLUDED.quantity
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM inserted), COALESCE((SELECT SUM(moves) FROM summed), 0)
+            """,
+            {'before': before, 'now': timezone.now()},
+        )
+        snapshots, compacted = cursor.fetchone()
+    return snapshots, int(compacted)
+
+def stock_drift():
+    """[(product_id, stock đang lưu, tổng tồn kho thực tế)] của các sản phẩm bị lệch, trong một truy vấn GROUP BY"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT p.id, p.stock, COALESCE(SUM(i.quantity), 0) AS total
+            FROM {Product._meta.db_table} p
+            LEFT JOIN {ProductInventory._meta.db_table} i ON i.product_id = p.id
+            GROUP BY p.id
+            HAVING p.stock <> COALESCE(SUM(i.quantity), 0)
+            ORDER BY p.id
+            """
+        )
+        return cursor.fetchall()
+
+def repair_stock():
+    """
+    Ghi lại Product.stock = tổng tồn kho cho các sản phẩm bị lệch; trả về [(product_id, stock mới)].
+    Khóa các sản phẩm lệch trước rồi mới tính tổng trong câu lệnh sau: transaction đồng thời đã đổi
+    tồn kho nhưng chưa kịp cộng delta sẽ cộng sau khi lệnh này commit, nên không bị tính hai lần.
+    """
+    with transaction.atomic():
+        product_ids = [row[0] for row in stock_drift()]
+        if not product_ids:
+            return []
+        list(Product.objects.filter(pk__in=product_ids).order_by('pk').select_for_update().values_list('pk', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {Product._meta.db_table} p
+                SET stock = t.total
+                FROM (
+                    SELECT p2.id, COALESCE(SUM(i.quantity), 0) AS total
+                    FROM {Product._meta.db_table} p2
+                    LEFT JOIN {ProductInventory._meta.db_table} i ON i.product_id = p2.id
+                    WHERE p2.id = ANY(%s)
+                    GROUP BY p2.id
+                ) t
+                WHERE p.id = t.id AND p.stock <> t.total
+                RETURNING p.id, p.stock
+                """,
+                [product_ids],
+            )
+            return sorted(cursor.fetchall())
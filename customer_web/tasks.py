@@ -0,0 +1,22 @@
+from django.db import transaction
+
+from .availability import invalidate_availability_many
+from .jobs import enqueue, task
+from .models import ProductCard
+from .orders import restock_orders
+
+
+@task('orders.restock')
+def restock(order_ids, reason='cancel', actor_id=None):
+    """Hoàn lại tồn kho cho các đơn vừa bị hủy/hoàn trả (một câu UPDATE cho tất cả dòng)"""
+    product_ids = restock_orders(order_ids, reason=reason, actor=actor_id)
+    if product_ids:
+        # Dựng lại card bằng job riêng (commit cùng transaction, lỗi thì được thử lại) thay vì callback sau commit
+        enqueue('catalog.refresh_cards', product_ids=product_ids)
+        # robust: lỗi cache sau commit chỉ được ghi log, không làm chết worker (job đã bị xóa)
+        transaction.on_commit(lambda: invalidate_availability_many(product_ids), robust=True)
+
+@task('catalog.refresh_cards')
+def refresh_cards(product_ids):
+    """Dựng lại card của các sản phẩm vừa thay đổi tồn kho (vd. sau khi đặt hàng)"""
+    ProductCard.refresh(product_ids)
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def category_count(context, slug):
+    """Số sản phẩm của danh mục trong menu, đọc từ category_nav (đã cache) của context processor"""
+    for category in context.get('category_nav') or []:
+        if category['slug'] == slug:
+            return format_html('<span class="text-muted small ms-1">({})</span>', category['product_count'])
+    return ''
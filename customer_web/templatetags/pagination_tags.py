@@ -0,0 +1,14 @@
+from django import template
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    """Giữ nguyên các tham số lọc hiện tại, chỉ thay cursor (và bỏ page kiểu cũ)"""
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+    if cursor:
+        params['cursor'] = cursor
+    else:
+        params.pop('cursor', None)
+    return '?' + params.urlencode()
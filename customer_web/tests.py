@@ -1,3 +1,395 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from .availability import get_availability, invalidate_availability
+from .cart import CartSummary
+from .checkout import InsufficientStock, place_order
+from .jobs import run_next_job
+from .models import (
+    Cart, CartItem, Job, Order, OrderItem, Product, ProductInventory, ProductRecommendation,
+    RecommendedOrder, StockMovement, StockReservation, StockSnapshot,
+)
+from .orders import OrderStateMachine, restock_orders
+from .pagination import CursorPaginator
+from .reservations import reserve_for_checkout
+from .stock import compact_movements, record_movements, movement, stock_at
+
+
+def make_product(name, price=100000, variants=None, **fields):
+    """Sản phẩm kèm tồn kho {(size, color): quantity}; Product.stock khớp tổng tồn kho"""
+    variants = variants or {}
+    product = Product.objects.create(
+        name=name,
+        slug=name.lower().replace(' ', '-'),
+        description=f'Mô tả {name}',
+        price=Decimal(price),
+        stock=sum(variants.values()),
+        sizes=','.join(sorted({size for size, color in variants})),
+        colors=','.join(sorted({color for size, color in variants})),
+        **fields,
+    )
+    for (size, color), quantity in variants.items():
+        ProductInventory.objects.create(
+            product=product, size=size, color=color, quantity=quantity, sku=f'{product.slug}-{color}-{size}'
+        )
+    return product
+
+def make_order(lines, status='pending'):
+    """Đơn hàng với các dòng [(product, size, color, quantity)]"""
+    order = Order.objects.create(
+        full_name='Khách', email='khach@example.com', phone='0900000000', address='Hà Nội',
+        total_amount=0, status=status,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, size=size, color=color, quantity=quantity, price=product.price)
+        for product, size, color, quantity in lines
+    ])
+    return order
+
+def hold(product, size, color, quantity, holder, minutes=15):
+    return StockReservation.objects.create(
+        inventory=ProductInventory.objects.get(product=product, size=size, color=color),
+        holder=holder,
+        quantity=quantity,
+        expires_at=timezone.now() + timedelta(minutes=minutes),
+    )
+
+
+class CartAddItemTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Ao thun', variants={('M', 'white'): 5})
+        self.cart = Cart.objects.create()
+
+    def test_adds_line_and_totals(self):
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 2)
+        self.assertEqual((stock, line_quantity, total_quantity), (5, 2, 2))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_amount, Decimal('200000'))
+
+    def test_repeated_add_upserts_one_line(self):
+        self.cart.add_item(self.product.pk, 'M', 'white', 2)
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 3)
+        self.assertEqual((line_quantity, total_quantity), (5, 5))
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 5)
+
+    def test_rejects_quantity_over_stock_without_changes(self):
+        self.cart.add_item(self.product.pk, 'M', 'white', 4)
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 2)
+        self.assertEqual((stock, line_quantity, total_quantity), (5, None, 4))
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 4)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_quantity, 4)
+
+    def test_unknown_variant(self):
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'XL', 'white', 1)
+        self.assertIsNone(stock)
+        self.assertIsNone(line_quantity)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_holds_of_other_shoppers_reduce_stock(self):
+        hold(self.product, 'M', 'white', 4, 'session:other')
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 2, holder='user:1')
+        self.assertEqual((stock, line_quantity), (1, None))
+        # Giữ hàng của chính người thêm không bị trừ
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 1, holder='session:other')
+        self.assertEqual((stock, line_quantity), (5, 1))
+
+    def test_expired_holds_are_ignored(self):
+        hold(self.product, 'M', 'white', 5, 'session:other', minutes=-1)
+        stock, line_quantity, total_quantity = self.cart.add_item(self.product.pk, 'M', 'white', 5, holder='user:1')
+        self.assertEqual((stock, line_quantity), (5, 5))
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        self.shirt = make_product('Ao so mi', variants={('S', 'blue'): 10})
+        self.skirt = make_product('Chan vay', price=250000, variants={('M', 'pink'): 10})
+        self.cart = Cart.objects.create()
+
+    def test_merge_lines_sums_duplicates_and_existing_lines(self):
+        self.cart.add_item(self.shirt.pk, 'S', 'blue', 1)
+        self.cart.merge_lines([
+            (self.shirt.pk, 'S', 'blue', 2),
+            (self.shirt.pk, 'S', 'blue', 1),
+            (self.skirt.pk, 'M', 'pink', 1),
+            (999999, 'M', 'pink', 1),  # sản phẩm không còn tồn tại
+        ])
+        lines = dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+        self.assertEqual(lines, {self.shirt.pk: 4, self.skirt.pk: 1})
+        self.assertEqual((self.cart.total_quantity, self.cart.total_amount), (5, Decimal('650000')))
+
+    def test_absorb_moves_lines_and_deletes_other_cart(self):
+        other = Cart.objects.create(session_key='legacy')
+        other.add_item(self.shirt.pk, 'S', 'blue', 2)
+        other.add_item(self.skirt.pk, 'M', 'pink', 1)
+        self.cart.add_item(self.shirt.pk, 'S', 'blue', 1)
+
+        self.cart.absorb(other)
+        lines = dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+        self.assertEqual(lines, {self.shirt.pk: 3, self.skirt.pk: 1})
+        self.assertFalse(Cart.objects.filter(pk=other.pk).exists())
+        self.assertEqual(self.cart.total_quantity, 4)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Quan jean', variants={('L', 'navy'): 3})
+        self.cart = Cart.objects.create()
+        self.cart.add_item(self.product.pk, 'L', 'navy', 2)
+
+    def order_fields(self):
+        return {'full_name': 'Khách', 'email': 'khach@example.com', 'phone': '0900000000', 'address': 'Hà Nội'}
+
+    def test_reserve_holds_the_cart(self):
+        shortages = reserve_for_checkout('session:a', CartSummary(self.cart))
+        self.assertEqual(shortages, [])
+        self.assertEqual(StockReservation.objects.get(holder='session:a').quantity, 2)
+
+    def test_second_shopper_cannot_hold_the_same_units(self):
+        reserve_for_checkout('session:a', CartSummary(self.cart))
+        other_cart = Cart.objects.create()
+        CartItem.objects.create(cart=other_cart, product=self.product, size='L', color='navy', quantity=2)
+
+        shortages = reserve_for_checkout('session:b', CartSummary(other_cart))
+        self.assertEqual(shortages, [{'key': (self.product.pk, 'L', 'navy'), 'requested': 2, 'available': 1}])
+        self.assertEqual(StockReservation.objects.get(holder='session:b').quantity, 1)
+
+    def test_reload_reuses_unexpired_holds(self):
+        reserve_for_checkout('session:a', CartSummary(self.cart))
+        reservation = StockReservation.objects.get(holder='session:a')
+
+        summary = CartSummary(self.cart)
+        summary.items
+        # Chỉ một truy vấn đọc giữ hàng hiện có, không xóa/ghi lại
+        with self.assertNumQueries(1):
+            self.assertEqual(reserve_for_checkout('session:a', summary), [])
+        self.assertEqual(
+            list(StockReservation.objects.filter(holder='session:a').values_list('pk', 'expires_at')),
+            [(reservation.pk, reservation.expires_at)],
+        )
+
+    def test_changed_cart_resizes_hold(self):
+        reserve_for_checkout('session:a', CartSummary(self.cart))
+        reservation = StockReservation.objects.get(holder='session:a')
+        CartItem.objects.filter(cart=self.cart).update(quantity=3)
+
+        self.assertEqual(reserve_for_checkout('session:a', CartSummary(self.cart)), [])
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.quantity, 3)
+
+    def test_availability_snapshot_subtracts_active_holds(self):
+        hold(self.product, 'L', 'navy', 2, 'session:other')
+        invalidate_availability(self.product.pk)
+        variant = get_availability(self.product.pk)['variants'][0]
+        self.assertEqual(variant['quantity'], 1)
+
+    def test_place_order_takes_stock_and_releases_holds(self):
+        reserve_for_checkout('session:a', CartSummary(self.cart))
+        order = place_order(CartSummary(self.cart), holder='session:a', **self.order_fields())
+
+        self.assertEqual(ProductInventory.objects.get(product=self.product).quantity, 1)
+        self.assertFalse(StockReservation.objects.filter(holder='session:a').exists())
+        self.assertEqual(
+            list(StockMovement.objects.filter(order=order).values_list('delta', 'reason')), [(-2, 'order')]
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertTrue(Job.objects.filter(task='catalog.refresh_cards').exists())
+
+    def test_place_order_does_not_oversell_held_stock(self):
+        hold(self.product, 'L', 'navy', 2, 'session:other')
+
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(CartSummary(self.cart), holder='session:a', **self.order_fields())
+        self.assertEqual(raised.exception.shortages[0]['available'], 1)
+        # Toàn bộ đơn bị rollback
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ProductInventory.objects.get(product=self.product).quantity, 3)
+        self.assertFalse(StockMovement.objects.exists())
+
+
+class OrderStateMachineTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Vay hoa', variants={('S', 'pink'): 5})
+
+    def test_bulk_transition_moves_allowed_orders_only(self):
+        pending = make_order([(self.product, 'S', 'pink', 1)])
+        delivered = make_order([(self.product, 'S', 'pink', 1)], status='delivered')
+        cancelled = make_order([(self.product, 'S', 'pink', 1)], status='cancelled')
+
+        moved, skipped = OrderStateMachine.bulk_transition(
+            [pending.pk, delivered.pk, cancelled.pk, 999999], 'cancelled'
+        )
+        self.assertEqual(moved, [pending.pk])
+        self.assertEqual(set(skipped), {delivered.pk, cancelled.pk, 999999})
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'cancelled')
+        self.assertIsNotNone(pending.cancelled_at)
+        self.assertEqual(Job.objects.get(task='orders.restock').payload['order_ids'], [pending.pk])
+
+    def test_cancel_restocks_through_job(self):
+        order = make_order([(self.product, 'S', 'pink', 2)])
+        OrderStateMachine(order).transition('cancelled')
+
+        self.assertTrue(run_next_job())
+        self.assertEqual(ProductInventory.objects.get(product=self.product).quantity, 7)
+        self.assertEqual(
+            list(StockMovement.objects.filter(order=order).values_list('delta', 'reason')), [(2, 'cancel')]
+        )
+        self.assertFalse(Job.objects.filter(task='orders.restock').exists())
+
+    def test_invalid_transition_is_rejected(self):
+        order = make_order([(self.product, 'S', 'pink', 1)], status='delivered')
+        with self.assertRaises(Exception):
+            OrderStateMachine(order).transition('cancelled')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'delivered')
+
+    def test_restock_recreates_deleted_variant(self):
+        order = make_order([(self.product, 'S', 'pink', 2), (self.product, 'M', 'pink', 1)])
+        ProductInventory.objects.filter(product=self.product, size='S').delete()
+
+        self.assertEqual(restock_orders([order.pk]), [self.product.pk])
+        quantities = dict(ProductInventory.objects.filter(product=self.product).values_list('size', 'quantity'))
+        self.assertEqual(quantities, {'S': 2, 'M': 1})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Mu len', variants={('M', 'red'): 0})
+
+    def test_compact_keeps_point_in_time_stock(self):
+        record_movements([movement(self.product.pk, 'M', 'red', 10, 'import')])
+        record_movements([movement(self.product.pk, 'M', 'red', -3, 'order')])
+        record_movements([movement(self.product.pk, 'M', 'red', 4, 'import')])
+        now = timezone.now()
+        old, older, recent = StockMovement.objects.order_by('pk')
+        StockMovement.objects.filter(pk=old.pk).update(created_at=now - timedelta(days=10))
+        StockMovement.objects.filter(pk=older.pk).update(created_at=now - timedelta(days=5))
+        before = {days: stock_at(self.product.pk, 'M', 'red', now - timedelta(days=days)) for days in (7, 3, 0)}
+
+        snapshots, compacted = compact_movements(now - timedelta(days=4))
+        self.assertEqual((snapshots, compacted), (1, 2))
+        self.assertEqual(StockSnapshot.objects.get(product=self.product).quantity, 7)
+        self.assertEqual(list(StockMovement.objects.values_list('pk', flat=True)), [recent.pk])
+        after = {days: stock_at(self.product.pk, 'M', 'red', now - timedelta(days=days)) for days in (3, 0)}
+        self.assertEqual(after, {3: before[3], 0: before[0]})
+        self.assertEqual(before, {7: 10, 3: 7, 0: 11})
+
+    def test_record_movements_applies_deltas_to_product_stock(self):
+        record_movements([
+            movement(self.product.pk, 'M', 'red', 5, 'import'),
+            movement(self.product.pk, 'M', 'red', 0, 'adjustment'),
+        ])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+
+class UpdateRecommendationsTests(TestCase):
+    def setUp(self):
+        self.shirt = make_product('Ao khoac', variants={('M', 'black'): 10})
+        self.pants = make_product('Quan kaki', variants={('M', 'beige'): 10})
+
+    def scores(self):
+        return dict(ProductRecommendation.objects.values_list('product_id', 'score'))
+
+    def run_command(self):
+        call_command('update_recommendations', stdout=StringIO())
+
+    def test_counts_pairs_once_and_subtracts_cancellations(self):
+        first = make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 1)])
+        second = make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 2)])
+
+        self.run_command()
+        self.assertEqual(self.scores(), {self.shirt.pk: 2, self.pants.pk: 2})
+        # Quét lại trong khoảng chồng lấn không cộng lại
+        self.run_command()
+        self.assertEqual(self.scores(), {self.shirt.pk: 2, self.pants.pk: 2})
+
+        OrderStateMachine(first).transition('cancelled')
+        self.run_command()
+        self.assertEqual(self.scores(), {self.shirt.pk: 1, self.pants.pk: 1})
+        self.assertFalse(RecommendedOrder.objects.filter(order=first).exists())
+
+        OrderStateMachine(second).transition('cancelled')
+        self.run_command()
+        self.assertEqual(self.scores(), {})
+
+    def test_picks_up_orders_updated_inside_overlap_window(self):
+        make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 1)])
+        self.run_command()
+        # Đơn commit muộn: updated_at sớm hơn mốc đã lưu nhưng vẫn trong khoảng chồng lấn
+        late = make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 1)])
+        Order.objects.filter(pk=late.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        # Đơn cũ hơn khoảng chồng lấn không được quét lại
+        stale = make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 1)])
+        Order.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        self.run_command()
+        self.assertEqual(self.scores(), {self.shirt.pk: 2, self.pants.pk: 2})
+        self.assertTrue(RecommendedOrder.objects.filter(order=late).exists())
+
+    def test_skips_orders_cancelled_before_counting(self):
+        make_order([(self.shirt, 'M', 'black', 1), (self.pants, 'M', 'beige', 1)], status='cancelled')
+        self.run_command()
+        self.assertEqual(self.scores(), {})
+        self.assertFalse(RecommendedOrder.objects.exists())
+
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        # Giá trùng nhau để kiểm tra khóa chính phân định thứ tự
+        for index in range(25):
+            make_product(f'San pham {index:02d}', price=100000 + (index // 3) * 1000)
+        self.queryset = Product.objects.all()
+
+    def expected(self):
+        return list(self.queryset.order_by('price', 'pk').values_list('pk', flat=True))
+
+    def walk_forward(self, paginator):
+        pages = []
+        page = paginator.get_page()
+        while True:
+            pages.append(page)
+            if not page.has_next():
+                return pages
+            page = paginator.get_page(page.next_cursor)
+
+    def test_forward_pages_cover_every_row_once(self):
+        pages = self.walk_forward(CursorPaginator(self.queryset, 10, ['price']))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertEqual([product.pk for page in pages for product in page], self.expected())
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[-1].has_previous())
+
+    def test_backward_paging_returns_the_same_pages(self):
+        paginator = CursorPaginator(self.queryset, 10, ['price'])
+        pages = self.walk_forward(paginator)
+
+        previous = paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual([product.pk for product in previous], [product.pk for product in pages[1]])
+        self.assertEqual(previous.number, 2)
+        self.assertTrue(previous.has_next())
+
+        first = paginator.get_page(previous.previous_cursor)
+        self.assertEqual([product.pk for product in first], [product.pk for product in pages[0]])
+        self.assertFalse(first.has_previous())
+
+    def test_descending_order(self):
+        pages = self.walk_forward(CursorPaginator(self.queryset, 10, ['-price']))
+        self.assertEqual([product.pk for page in pages for product in page], self.expected()[::-1])
 
-# Create your tests here.
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = CursorPaginator(self.queryset, 10, ['price'])
+        page = paginator.get_page('not-a-valid-cursor')
+        self.assertEqual(page.number, 1)
+        self.assertEqual([product.pk for product in page], self.expected()[:10])
@@ -14,11 +14,13 @@ urlpatterns = [
     path('cart/', views.cart_view, name='cart'),
     path('update-cart/', views.update_cart, name='update_cart'),
     path('remove-from-cart/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch-update/', views.batch_update_cart, name='batch_update_cart'),
     path('get-cart-total/', views.get_cart_total, name='get_cart_total'),
 
     
     # Product inventory API
     path('api/product/<int:product_id>/inventory/', views.get_product_inventory, name='get_product_inventory'),
+    path('api/products/inventory/', views.get_products_inventory, name='get_products_inventory'),
     
     # User authentication
     path('login/', views.login_view, name='login'),
@@ -3,90 +3,108 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
-from django.core.paginator import Paginator
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import condition
+from django.db.models import F, Q, Prefetch
+from django.db.models.functions import Coalesce
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 import json
 
 from .models import (
-    Category, Product, ProductImage, ProductInventory, CustomerProfile, 
-    Cart, CartItem, Order, OrderItem
+    Product, ProductImage, ProductInventory, ProductCard, CustomerProfile, 
+    Cart, CartItem, Order, OrderItem, primary_image_prefetch
 )
 from admin_dashboard.models import News
+from .facets import parse_filters, filters_q, facet_counts
+from .pagination import CursorPaginator
+from .caching import get_version
+from .navigation import get_category_navigation
+from .cart import (
+    GuestCart, get_guest_cart, claim_guest_cart, get_cart_summary, remember_cart_total, forget_cart_total, cart_total_for_request
+)
+from .availability import get_availability, get_availability_many, find_variant
+from .checkout import (
+    place_order, InsufficientStock, new_checkout_key, clean_checkout_key, find_order_for_key, remember_checkout_key
+)
+from .reservations import RESERVATION_TTL, held_quantities, reservation_holder, reserve_for_checkout
+from .orders import OrderStateMachine, InvalidTransition
 
 def get_or_create_cart(request):
-    """Get or create cart for user or session"""
+    """Giỏ hàng của request: Cart trong DB cho người dùng đã đăng nhập, GuestCart (cookie) cho khách"""
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        cart, created = Cart.objects.get_or_create(session_key=request.session.session_key)
-    return cart
+        return cart
+    return get_guest_cart(request)
 
 # Home page
 def home(request):
-    featured_products = Product.objects.filter(is_featured=True, is_active=True)[:8]
-    hot_trend_products = Product.objects.filter(is_hot_trend=True, is_active=True)[:8]
-    new_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
-    categories = Category.objects.filter(is_active=True)
+    # Các queryset là lazy: khi fragment đã có trong cache (theo home_version) sẽ không truy vấn DB
+    featured_products = ProductCard.objects.filter(is_featured=True, is_active=True)[:8]
+    hot_trend_products = ProductCard.objects.filter(is_hot_trend=True, is_active=True)[:8]
+    new_products = ProductCard.objects.filter(is_active=True).order_by('-created_at')[:8]
     featured_news = News.objects.filter(status='published', featured=True)[:3]
     
     context = {
         'featured_products': featured_products,
         'hot_trend_products': hot_trend_products,
         'new_products': new_products,
-        'categories': categories,
         'featured_news': featured_news,
+        'home_version': get_version('home'),
+        'home_cache_timeout': settings.HOME_FRAGMENT_CACHE_TIMEOUT,
     }
     return render(request, 'customer_web/home.html', context)
 
 # Product listing
 def product_list(request):
-    products = Product.objects.filter(is_active=True)
-    categories = Category.objects.filter(is_active=True)
-    
-    # Filter by categories
-    category_slugs = request.GET.get('categories', '')
-    selected_categories = []
-    if category_slugs:
-        q = Q()
-        for slug in category_slugs.split(','):
-            selected_categories.append(slug)
-            q |= Q(categories__slug=slug)  # dùng toán tử OR
-        products = products.filter(q).distinct()
+    products = ProductCard.objects.filter(is_active=True)
+    categories = get_category_navigation()
+    
     # Search
     search_query = request.GET.get('search')
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        products = products.search(search_query)
+    
+    # Faceted filters: danh mục, size, màu, khoảng giá, còn hàng
+    filters = parse_filters(request.GET)
+    selected_categories = filters['categories']
+    facets = facet_counts(
+        products, filters,
+        [(category['slug'], category['name']) for category in categories],
+        search_query,
+    )
+    products = products.filter(filters_q(filters))
     
-    # Sort
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
+    # Sort - mặc định theo độ liên quan khi có từ khóa tìm kiếm
+    sort_by = request.GET.get('sort') or ('relevance' if search_query else 'newest')
+    total = facets['total']  # đã có sẵn từ facet counts (cache)
+    if sort_by == 'relevance' and search_query:
+        ordering = ['-rank', '-created_at']
+    elif sort_by == 'price_low':
+        ordering = ['price']
     elif sort_by == 'price_high':
-        products = products.order_by('-price')
+        ordering = ['-price']
     elif sort_by == 'name':
-        products = products.order_by('name')
+        ordering = ['name']
     elif sort_by == 'trending':
-        products = products.filter(is_hot_trend=True).order_by('-created_at')
+        products = products.filter(is_hot_trend=True)
+        ordering = ['-created_at']
+        total = None
     else:  # newest
-        products = products.order_by('-created_at')
+        ordering = ['-created_at']
     
-    # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination (keyset)
+    paginator = CursorPaginator(products, 12, ordering, count=total)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'products': page_obj,
         'categories': categories,
         'selected_categories': selected_categories,
+        'filters': filters,
+        'facets': facets,
         'search_query': search_query,
         'sort_by': sort_by,
     }
@@ -94,28 +112,33 @@ def product_list(request):
 
 # Product detail
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    # Lấy danh mục đầu tiên (nếu có) để gợi ý sản phẩm liên quan
-    first_category = product.categories.first()
-    if first_category:
-        related_products = Product.objects.filter(
-            categories=first_category,
-            is_active=True
-        ).exclude(id=product.id)[:4]
-    else:
-        related_products = Product.objects.filter(is_active=True).exclude(id=product.id)[:4]
+    product = get_object_or_404(Product.objects.select_related('card'), slug=slug, is_active=True)
+    # Gợi ý "thường được mua cùng" (bảng ProductRecommendation), sắp theo số đơn mua chung
+    related_products = list(ProductCard.objects.filter(
+        is_active=True,
+        product__recommended_in__product=product,
+    ).order_by('-product__recommended_in__score')[:4])
+    
+    # Bổ sung bằng sản phẩm cùng danh mục đầu tiên nếu chưa đủ gợi ý
+    if len(related_products) < 4:
+        category_slugs = product.card.category_slugs if hasattr(product, 'card') else []
+        fallback = ProductCard.objects.filter(is_active=True).exclude(
+            pk__in=[product.pk] + [card.pk for card in related_products]
+        )
+        if category_slugs:
+            fallback = fallback.filter(category_slugs__contains=category_slugs[:1])
+        related_products += list(fallback[:4 - len(related_products)])
     
     # Convert sizes and colors from string to list
     sizes_list = [size.strip() for size in product.sizes.split(',') if size.strip()] if product.sizes else []
     colors_list = [color.strip() for color in product.colors.split(',') if color.strip()] if product.colors else []
     
-    # Get inventory data for size and color combinations
+    # Get inventory data for size and color combinations (từ snapshot tồn kho đã cache)
     inventory_data = {}
     if sizes_list and colors_list:
-        inventory_items = product.inventory.all()
-        for item in inventory_items:
-            key = f"{item.size}-{item.color}"
-            inventory_data[key] = item.quantity
+        for variant in get_availability(product.pk)['variants']:
+            key = f"{variant['size']}-{variant['color']}"
+            inventory_data[key] = variant['quantity']
     
     context = {
         'product': product,
@@ -126,47 +149,42 @@ def product_detail(request, slug):
     }
     return render(request, 'customer_web/product_detail.html', context)
 
+def _inventory_etag(request, product_id):
+    snapshot = get_availability(product_id)
+    return snapshot['etag'] if snapshot else None
+
+def _inventory_last_modified(request, product_id):
+    snapshot = get_availability(product_id)
+    return snapshot['last_modified'] if snapshot else None
+
 # API endpoint to get inventory info
+# ETag/Last-Modified lấy từ snapshot trong cache nên request lặp lại nhận 304 mà không truy vấn DB
 @csrf_exempt
+@condition(etag_func=_inventory_etag, last_modified_func=_inventory_last_modified)
 def get_product_inventory(request, product_id):
     """API để lấy thông tin tồn kho theo size và màu"""
     if request.method == 'GET':
         try:
-            product = get_object_or_404(Product, id=product_id)
+            snapshot = get_availability(product_id)
+            if snapshot is None:
+                return JsonResponse({'success': False, 'error': 'Sản phẩm không tồn tại'}, status=404)
             size = request.GET.get('size', '')
             color = request.GET.get('color', '')
             
             # If both size and color are provided, get specific inventory
             if size and color:
-                try:
-                    inventory = product.inventory.get(size=size, color=color)
-                    return JsonResponse({
-                        'success': True,
-                        'quantity': inventory.quantity,
-                        'sku': inventory.sku
-                    })
-                except:
-                    return JsonResponse({
-                        'success': True,
-                        'quantity': 0,
-                        'sku': ''
-                    })
+                variant = find_variant(snapshot, size, color)
+                return JsonResponse({
+                    'success': True,
+                    'quantity': variant['quantity'] if variant else 0,
+                    'sku': variant['sku'] if variant else ''
+                })
             
             # Return all variants for the product (for modal)
             else:
-                inventory_items = product.inventory.all()
-                variants = []
-                for item in inventory_items:
-                    variants.append({
-                        'size': item.size,
-                        'color': item.color,
-                        'quantity': item.quantity,
-                        'sku': item.sku
-                    })
-                
                 return JsonResponse({
                     'success': True,
-                    'variants': variants
+                    'variants': snapshot['variants']
                 })
                 
         except Exception as e:
@@ -177,6 +195,79 @@ def get_product_inventory(request, product_id):
     
     return JsonResponse({'success': False, 'error': 'Method not allowed'})
 
+# Số sản phẩm tối đa trong một request tra cứu tồn kho hàng loạt
+BATCH_INVENTORY_LIMIT = 100
+
+@csrf_exempt
+def get_products_inventory(request):
+    """
+    API tra cứu tồn kho của nhiều sản phẩm trong một request.
+    GET ?ids=1,2,3 hoặc POST JSON {"product_ids": [...], "items": [{"product_id", "size", "color"}, ...]}.
+    Trả về toàn bộ biến thể của từng sản phẩm và (nếu có) số lượng của từng cặp size/màu được hỏi.
+    """
+    try:
+        items = []
+        if request.method == 'GET':
+            raw_ids = request.GET.get('ids', '').split(',')
+        elif request.method == 'POST':
+            data = json.loads(request.body or '{}')
+            raw_ids = list(data.get('product_ids') or [])
+            items = data.get('items') or []
+            raw_ids += [item.get('product_id') for item in items]
+        else:
+            return JsonResponse({'success': False, 'error': 'Method not allowed'})
+        
+        product_ids = []
+        for raw_id in raw_ids:
+            try:
+                product_id = int(raw_id)
+            except (TypeError, ValueError):
+                continue
+            if product_id not in product_ids:
+                product_ids.append(product_id)
+        if len(product_ids) > BATCH_INVENTORY_LIMIT:
+            return JsonResponse({
+                'success': False,
+                'error': f'Tối đa {BATCH_INVENTORY_LIMIT} sản phẩm mỗi lần tra cứu'
+            }, status=400)
+        
+        snapshots = get_availability_many(product_ids)
+        products = {}
+        for product_id, snapshot in snapshots.items():
+            products[str(product_id)] = {
+                'variants': snapshot['variants'],
+                'in_stock': any(variant['quantity'] > 0 for variant in snapshot['variants']),
+            }
+        
+        results = []
+        for item in items:
+            try:
+                product_id = int(item.get('product_id'))
+            except (TypeError, ValueError):
+                continue
+            size = item.get('size') or ''
+            color = item.get('color') or ''
+            variant = find_variant(snapshots[product_id], size, color) if product_id in snapshots else None
+            results.append({
+                'product_id': product_id,
+                'size': size,
+                'color': color,
+                'quantity': variant['quantity'] if variant else 0,
+                'sku': variant['sku'] if variant else '',
+            })
+        
+        return JsonResponse({
+            'success': True,
+            'products': products,
+            'items': results
+        })
+    
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
 # Add to cart
 @csrf_exempt
 def add_to_cart(request):
@@ -195,42 +286,51 @@ def add_to_cart(request):
             if not size:
                 return JsonResponse({'success': False, 'message': 'Vui lòng chọn kích thước'})
             
-            product = get_object_or_404(Product, id=product_id)
+            try:
+                product_id = int(product_id)
+            except (ValueError, TypeError):
+                return JsonResponse({'success': False, 'message': 'Sản phẩm không hợp lệ'})
+            color = color or ''
             cart = get_or_create_cart(request)
             
-            # Check inventory
-            from customer_web.models import ProductInventory
-            try:
-                inventory = ProductInventory.objects.get(
-                    product=product,
-                    size=size,
-                    color=color or ''
-                )
-                if inventory.quantity < quantity:
+            if isinstance(cart, GuestCart):
+                # Khách: kiểm tra tồn kho theo snapshot đã cache, giỏ nằm trong cookie
+                snapshot = get_availability(product_id)
+                variant = find_variant(snapshot, size, color) if snapshot else None
+                if variant is None:
+                    return JsonResponse({'success': False, 'message': 'Sản phẩm không có sẵn với thông số này'})
+                # quantity trong snapshot đã trừ mọi giữ hàng, kể cả giữ hàng của chính khách này (đang thanh toán)
+                holder = reservation_holder(request)
+                available = variant['quantity'] + (held_quantities(holder).get((product_id, size, color), 0) if holder else 0)
+                in_cart = sum(line[4] for line in cart if line[1:4] == [product_id, size, color])
+                if available < in_cart + quantity:
                     return JsonResponse({
-                        'success': False, 
-                        'message': f'Chỉ còn {inventory.quantity} sản phẩm trong kho'
+                        'success': False,
+                        'message': f'Chỉ còn {available} sản phẩm trong kho'
                     })
-            except ProductInventory.DoesNotExist:
-                return JsonResponse({'success': False, 'message': 'Sản phẩm không có sẵn với thông số này'})
+                cart.add(product_id, size, color, quantity)
+                return cart.save(JsonResponse({
+                    'success': True,
+                    'message': 'Đã thêm vào giỏ hàng',
+                    'cart_total_items': cart.total_quantity
+                }))
             
-            # Check if item already exists in cart
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                size=size,
-                color=color,
-                defaults={'quantity': quantity}
+            # Kiểm tra tồn kho + upsert dòng giỏ hàng + cập nhật bộ đếm trong một câu lệnh
+            stock, line_quantity, total_quantity = cart.add_item(
+                product_id, size, color, quantity, holder=reservation_holder(request)
             )
-            
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+            if stock is None:
+                return JsonResponse({'success': False, 'message': 'Sản phẩm không có sẵn với thông số này'})
+            if line_quantity is None:
+                return JsonResponse({
+                    'success': False, 
+                    'message': f'Chỉ còn {stock} sản phẩm trong kho'
+                })
             
             return JsonResponse({
                 'success': True,
                 'message': 'Đã thêm vào giỏ hàng',
-                'cart_total_items': cart.total_items
+                'cart_total_items': remember_cart_total(request, cart)
             })
             
         except Exception as e:
@@ -242,18 +342,20 @@ def add_to_cart(request):
 @csrf_exempt
 def get_cart_total(request):
     try:
-        cart = get_or_create_cart(request)
         return JsonResponse({
             'success': True,
-            'cart_total': cart.total_items
+            'cart_total': cart_total_for_request(request)
         })
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 # Cart view
+# Trang giỏ hàng không render {% csrf_token %} nhưng JS gửi X-CSRFToken từ cookie cho batch_update_cart
+@ensure_csrf_cookie
 def cart_view(request):
     cart = get_or_create_cart(request)
     context = {
         'cart': cart,
+        'cart_summary': get_cart_summary(request, cart),
     }
     return render(request, 'customer_web/cart.html', context)
 
@@ -263,10 +365,21 @@ def update_cart(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            item_id = data.get('item_id')
+            item_id = int(data.get('item_id'))
             quantity = int(data.get('quantity'))
             
-            cart_item = get_object_or_404(CartItem, id=item_id)
+            if not request.user.is_authenticated:
+                guest_cart = get_guest_cart(request)
+                if not guest_cart.set_quantity(item_id, quantity):
+                    return JsonResponse({'success': False, 'message': 'Sản phẩm không có trong giỏ hàng'})
+                summary = get_cart_summary(request, guest_cart)
+                return guest_cart.save(JsonResponse({
+                    'success': True,
+                    'cart_total': summary.total_items,
+                    'cart_price': float(summary.total_price)
+                }))
+            
+            cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
             
             if quantity > 0:
                 cart_item.quantity = quantity
@@ -275,10 +388,11 @@ def update_cart(request):
                 cart_item.delete()
             
             cart = cart_item.cart
+            cart.update_totals()
             return JsonResponse({
                 'success': True,
-                'cart_total': cart.total_items,
-                'cart_price': float(cart.total_price)
+                'cart_total': remember_cart_total(request, cart),
+                'cart_price': float(cart.total_amount)
             })
             
         except Exception as e:
@@ -292,16 +406,91 @@ def remove_from_cart(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            item_id = data.get('item_id')
+            item_id = int(data.get('item_id'))
+            
+            if not request.user.is_authenticated:
+                guest_cart = get_guest_cart(request)
+                if not guest_cart.remove(item_id):
+                    return JsonResponse({'success': False, 'message': 'Sản phẩm không có trong giỏ hàng'})
+                summary = get_cart_summary(request, guest_cart)
+                return guest_cart.save(JsonResponse({
+                    'success': True,
+                    'cart_total': summary.total_items,
+                    'cart_price': float(summary.total_price)
+                }))
             
-            cart_item = get_object_or_404(CartItem, id=item_id)
+            cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
             cart = cart_item.cart
             cart_item.delete()
             
+            cart.update_totals()
+            return JsonResponse({
+                'success': True,
+                'cart_total': remember_cart_total(request, cart),
+                'cart_price': float(cart.total_amount)
+            })
+            
+        except Exception as e:
+            return JsonResponse({'success': False, 'message': str(e)})
+    
+    return JsonResponse({'success': False, 'message': 'Method not allowed'})
+
+# Áp dụng nhiều thay đổi số lượng trong giỏ hàng cùng lúc
+def batch_update_cart(request):
+    """
+    Nhận {"changes": [{"item_id": ..., "quantity": ...}, ...]} (quantity = 0 là xóa dòng).
+    Mọi dòng phải thuộc giỏ của người gọi; các thay đổi được áp dụng trong một transaction
+    (bulk_update + một câu DELETE) và trả về tổng giỏ hàng một lần.
+    """
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            changes = {}
+            for change in data.get('changes') or []:
+                try:
+                    changes[int(change['item_id'])] = max(0, int(change['quantity']))
+                except (KeyError, ValueError, TypeError):
+                    return JsonResponse({'success': False, 'message': 'Dữ liệu cập nhật không hợp lệ'})
+            if not changes:
+                return JsonResponse({'success': False, 'message': 'Không có thay đổi nào'})
+            
+            if not request.user.is_authenticated:
+                guest_cart = get_guest_cart(request)
+                if any(guest_cart.find(item_id) is None for item_id in changes):
+                    return JsonResponse({'success': False, 'message': 'Sản phẩm không có trong giỏ hàng'})
+                for item_id, quantity in changes.items():
+                    guest_cart.set_quantity(item_id, quantity)
+                summary = get_cart_summary(request, guest_cart)
+                return guest_cart.save(JsonResponse({
+                    'success': True,
+                    'cart_total': summary.total_items,
+                    'cart_price': float(summary.total_price)
+                }))
+            
+            cart = Cart.objects.filter(user=request.user).first()
+            if cart is None:
+                return JsonResponse({'success': False, 'message': 'Sản phẩm không có trong giỏ hàng'})
+            
+            with transaction.atomic():
+                items = list(CartItem.objects.select_for_update().filter(cart=cart, id__in=changes))
+                if len(items) != len(changes):
+                    return JsonResponse({'success': False, 'message': 'Sản phẩm không có trong giỏ hàng'})
+                
+                updated = []
+                for item in items:
+                    if changes[item.id] > 0:
+                        item.quantity = changes[item.id]
+                        updated.append(item)
+                CartItem.objects.bulk_update(updated, ['quantity'])
+                removed = [item_id for item_id, quantity in changes.items() if quantity == 0]
+                if removed:
+                    CartItem.objects.filter(cart=cart, id__in=removed).delete()
+                cart.update_totals()
+            
             return JsonResponse({
                 'success': True,
-                'cart_total': cart.total_items,
-                'cart_price': float(cart.total_price)
+                'cart_total': remember_cart_total(request, cart),
+                'cart_price': float(cart.total_amount)
             })
             
         except Exception as e:
@@ -317,34 +506,19 @@ def login_view(request):
         
         user = authenticate(request, username=username, password=password)
         if user is not None:
+            # login() đổi session key, cần lấy key cũ trước để tìm giỏ khách tạo theo session (dữ liệu cũ)
+            session_key = request.session.session_key
             login(request, user)
             
-            # Merge guest cart with user cart
-            guest_cart = None
-            if request.session.session_key:
-                try:
-                    guest_cart = Cart.objects.get(session_key=request.session.session_key)
-                except Cart.DoesNotExist:
-                    pass
-            
-            if guest_cart:
-                user_cart, created = Cart.objects.get_or_create(user=user)
-                # Move items from guest cart to user cart
-                for item in guest_cart.items.all():
-                    cart_item, created = CartItem.objects.get_or_create(
-                        cart=user_cart,
-                        product=item.product,
-                        size=item.size,
-                        color=item.color,
-                        defaults={'quantity': item.quantity}
-                    )
-                    if not created:
-                        cart_item.quantity += item.quantity
-                        cart_item.save()
-                guest_cart.delete()
+            response = redirect('customer_web:home')
+            # Badge lưu trong session (nếu có) không còn đúng sau khi đăng nhập
+            forget_cart_total(request)
+            
+            # Gộp giỏ khách (cookie và giỏ cũ theo session key) vào giỏ của tài khoản
+            claim_guest_cart(request, user, response, session_key)
             
             # Đăng nhập thành công - không hiển thị thông báo
-            return redirect('customer_web:home')
+            return response
         else:
             messages.error(request, 'Tên đăng nhập hoặc mật khẩu không đúng!')
     
@@ -421,9 +595,16 @@ def profile_view(request):
 
 # Checkout
 def checkout_view(request):
+    # Form gửi lại (bấm nhiều lần, trình duyệt gửi lại): trả về đơn đã tạo, không chạy lại quy trình đặt hàng
+    checkout_key = clean_checkout_key(request.POST.get('checkout_key')) if request.method == 'POST' else ''
+    existing_order_id = find_order_for_key(checkout_key)
+    if existing_order_id:
+        return redirect('customer_web:order_success', order_id=existing_order_id)
+    
     cart = get_or_create_cart(request)
+    cart_summary = get_cart_summary(request, cart)
     
-    if not cart.items.exists():
+    if not cart_summary:
         messages.error(request, 'Giỏ hàng trống!')
         return redirect('customer_web:cart')
     
@@ -441,60 +622,83 @@ def checkout_view(request):
         notes = request.POST.get('notes', '')
         payment_method = request.POST.get('payment_method', 'cod')
         
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            guest_email=email if not request.user.is_authenticated else None,
-            guest_phone=phone if not request.user.is_authenticated else None,
-            full_name=full_name,
-            email=email,
-            phone=phone,
-            address=address,
-            payment_method=payment_method,
-            total_amount=cart.total_price,
-            notes=notes
-        )
-        
-        # Create order items
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                size=item.size,
-                color=item.color,
-                quantity=item.quantity,
-                price=item.product.get_price
-            )
-            
-            # Update ProductInventory instead of Product.stock
-            try:
-                inventory = ProductInventory.objects.get(
-                    product=item.product,
-                    size=item.size,
-                    color=item.color
+        # Tạo đơn, trừ tồn kho và dọn giỏ trong một transaction; thiếu hàng thì rollback toàn bộ
+        guest_cart = cart if isinstance(cart, GuestCart) else None
+        try:
+            with transaction.atomic():
+                if guest_cart is not None:
+                    # Giỏ của khách chỉ được ghi vào Cart/CartItem tại bước đặt hàng
+                    cart = guest_cart.materialize()
+                    cart_summary = get_cart_summary(request, cart)
+                
+                order = place_order(
+                    cart_summary,
+                    holder=reservation_holder(request),
+                    user=request.user if request.user.is_authenticated else None,
+                    guest_email=email if not request.user.is_authenticated else None,
+                    guest_phone=phone if not request.user.is_authenticated else None,
+                    full_name=full_name,
+                    email=email,
+                    phone=phone,
+                    address=address,
+                    payment_method=payment_method,
+                    notes=notes,
+                    idempotency_key=checkout_key or None
                 )
-                inventory.quantity -= item.quantity
-                inventory.save()
-            except ProductInventory.DoesNotExist:
-                # Create new inventory with 0 quantity (deficit)
-                from admin_dashboard.views import generate_unique_sku
-                sku = generate_unique_sku(item.product, item.color, item.size)
-                ProductInventory.objects.create(
-                    product=item.product,
-                    size=item.size,
-                    color=item.color,
-                    quantity=-item.quantity,  # Negative to indicate deficit
-                    sku=sku
+                
+                # Clear cart
+                if guest_cart is not None:
+                    # Giỏ tạm của khách: xóa hẳn
+                    cart.delete()
+                else:
+                    cart.items.all().delete()
+                    cart.update_totals()
+        except InsufficientStock as e:
+            for shortage in e.shortages:
+                variant = ' / '.join(value for value in (shortage['size'], shortage['color']) if value)
+                messages.error(
+                    request,
+                    f"{shortage['product'].name} ({variant}): chỉ còn {shortage['available']} sản phẩm, "
+                    f"bạn đặt {shortage['requested']}"
                 )
+            return redirect('customer_web:cart')
+        except IntegrityError:
+            # Một request khác với cùng khóa vừa tạo đơn (gửi trùng đồng thời)
+            existing_order_id = find_order_for_key(checkout_key) if checkout_key else None
+            if existing_order_id:
+                return redirect('customer_web:order_success', order_id=existing_order_id)
+            raise
         
-        # Clear cart
-        cart.items.all().delete()
-        
+        if checkout_key:
+            remember_checkout_key(checkout_key, order.order_id)
         messages.success(request, f'Đặt hàng thành công! Mã đơn hàng: {order.order_id.hex[:8]}')
-        return redirect('customer_web:order_success', order_id=order.order_id)
+        response = redirect('customer_web:order_success', order_id=order.order_id)
+        if guest_cart is not None:
+            guest_cart.clear()
+            guest_cart.save(response)
+        else:
+            remember_cart_total(request, cart)
+        return response
+    
+    # Giữ hàng cho giỏ trong thời gian khách điền thông tin thanh toán. Giỏ chắc chắn không rỗng (đã chuyển hướng ở trên)
+    # nên session của khách chỉ được tạo khi thực sự có hàng để giữ; tải lại trang dùng lại giữ hàng còn hiệu lực
+    shortages = reserve_for_checkout(reservation_holder(request, create=True), cart_summary)
+    if shortages:
+        items = {(item.product_id, item.size, item.color): item for item in cart_summary.items}
+        for shortage in shortages:
+            item = items[shortage['key']]
+            messages.warning(
+                request,
+                f"{item.product.name}: hiện chỉ còn {shortage['available']} sản phẩm có thể đặt "
+                f"(bạn chọn {shortage['requested']})"
+            )
     
     context = {
         'cart': cart,
+        'cart_summary': cart_summary,
         'user_profile': user_profile,
+        'reservation_minutes': RESERVATION_TTL // 60,
+        'checkout_key': new_checkout_key(),
     }
     return render(request, 'customer_web/checkout.html', context)
 
@@ -509,7 +713,10 @@ def order_success(request, order_id):
 # Order history
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+        primary_image_prefetch('items__product__images'),
+    ).order_by('-created_at')
     context = {
         'orders': orders,
     }
@@ -547,33 +754,11 @@ def cancel_order(request, order_id):
             elif reason == 'delivery_too_long':
                 cancel_reason_text = "Thời gian giao hàng quá lâu"
             
-            # Update order status
-            order.status = 'cancelled'
-            order.cancel_reason = cancel_reason_text
-            order.cancelled_at = timezone.now()
-            order.save()
-            
-            # Restore ProductInventory stock
-            for item in order.items.all():
-                try:
-                    inventory = ProductInventory.objects.get(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color
-                    )
-                    inventory.quantity += item.quantity
-                    inventory.save()
-                except ProductInventory.DoesNotExist:
-                    # Create new inventory if not exists
-                    from admin_dashboard.views import generate_unique_sku
-                    sku = generate_unique_sku(item.product, item.color, item.size)
-                    ProductInventory.objects.create(
-                        product=item.product,
-                        size=item.size,
-                        color=item.color,
-                        quantity=item.quantity,
-                        sku=sku
-                    )
+            # Hủy đơn qua OrderStateMachine; việc hoàn lại tồn kho được xếp job cho worker
+            try:
+                OrderStateMachine(order).transition('cancelled', actor=request.user, cancel_reason=cancel_reason_text)
+            except InvalidTransition as e:
+                return JsonResponse({'success': False, 'message': str(e)})
             
             return JsonResponse({'success': True})
             
@@ -631,10 +816,10 @@ def request_return(request, order_id):
             full_return_reason = f"{return_reason_text}\nMô tả chi tiết: {description}"
             
             # Update order status and save return info
-            order.status = 'return_requested'
-            order.return_reason = full_return_reason
-            order.return_requested_at = timezone.now()
-            order.save()
+            try:
+                OrderStateMachine(order).transition('return_requested', actor=request.user, return_reason=full_return_reason)
+            except InvalidTransition as e:
+                return JsonResponse({'success': False, 'message': str(e)})
             
             return JsonResponse({'success': True})
             
@@ -701,6 +886,7 @@ def reorder_items(request, order_id):
                 
                 items_added += 1
             
+            cart.update_totals()
             message = f'Đã thêm {items_added} sản phẩm vào giỏ hàng!'
             if items_skipped > 0:
                 message += f' ({items_skipped} sản phẩm không khả dụng)'
@@ -709,7 +895,7 @@ def reorder_items(request, order_id):
                 'success': True,
                 'message': message,
                 'items_count': items_added,
-                'cart_total_items': cart.total_items
+                'cart_total_items': remember_cart_total(request, cart)
             })
             
         except Exception as e:
@@ -720,7 +906,10 @@ def reorder_items(request, order_id):
 # News views
 def news_list(request):
     """Danh sách tin tức"""
-    news = News.objects.filter(status='published').order_by('-published_at')
+    # published_at có thể NULL (tin cũ) nên sắp xếp theo ngày xuất bản, thiếu thì lấy ngày tạo
+    news = News.objects.filter(status='published').annotate(
+        published_sort=Coalesce('published_at', 'created_at')
+    ).order_by('-published_sort')
     
     # Search
     query = request.GET.get('search', '')
@@ -729,10 +918,9 @@ def news_list(request):
             Q(title__icontains=query) | Q(summary__icontains=query) | Q(content__icontains=query)
         )
     
-    # Pagination
-    paginator = Paginator(news, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination (keyset)
+    paginator = CursorPaginator(news, 12, ['-published_sort'])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'news_list': page_obj,
@@ -746,9 +934,9 @@ def news_detail(request, slug):
     """Chi tiết tin tức"""
     news = get_object_or_404(News, slug=slug, status='published')
     
-    # Tăng lượt xem
+    # Tăng lượt xem bằng UPDATE trực tiếp: không gửi post_save nên không vô hiệu cache trang chủ
+    News.objects.filter(pk=news.pk).update(views=F('views') + 1)
     news.views += 1
-    news.save()
     
     # Tin tức liên quan
     related_news = News.objects.filter(
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'customer_web',
     'staff_portal',
     'admin_dashboard',
@@ -65,6 +67,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'customer_web.context_processors.cart_total_items',
+                'customer_web.context_processors.category_navigation',
             ],
         },
     },
@@ -88,6 +91,65 @@ DATABASES = {
 }
 
 
+# Cache
+# Các key version (customer_web.caching) và snapshot tồn kho được web process và worker run_workers
+# cùng ghi/xóa nên khi chạy run_workers cache phải là bộ nhớ dùng chung giữa các process:
+# đặt KIKI_CACHE_URL=redis://host:6379/0 (cần gói redis) hoặc memcached://host:11211 (cần gói pymemcache).
+# Không đặt thì dùng LocMemCache, chỉ phù hợp khi phát triển với một process và không chạy worker.
+CACHE_URL = os.environ.get('KIKI_CACHE_URL', '')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': CACHE_URL[len('memcached://'):],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'kiki-default',
+        }
+    }
+
+# Thời gian sống của fragment cache trang chủ (giây); nội dung tự vô hiệu khi version thay đổi
+HOME_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Snapshot tồn kho theo sản phẩm (customer_web.availability) bị xóa khi tồn kho thay đổi
+INVENTORY_SNAPSHOT_CACHE_TIMEOUT = 60 * 60
+
+# Menu danh mục kèm số sản phẩm (customer_web.navigation), tự vô hiệu theo version 'catalog'
+CATEGORY_NAV_CACHE_TIMEOUT = 60 * 60
+
+# Thời gian lưu giỏ hàng của khách trong cookie đã ký (customer_web.cart.GuestCart)
+GUEST_CART_MAX_AGE = 60 * 60 * 24 * 30
+
+# Giỏ khách lưu trong DB không dùng quá số ngày này sẽ bị lệnh reap_carts xóa
+GUEST_CART_TTL_DAYS = 30
+
+# Thời gian giữ hàng (giây) khi khách mở trang thanh toán (customer_web.reservations)
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Thời gian cache khóa chống gửi trùng form thanh toán (customer_web.checkout)
+CHECKOUT_KEY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Hàng đợi công việc nền (customer_web.jobs, lệnh run_workers)
+JOB_WORKER_PROCESSES = 2
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_DELAY = 30
+
+# Biến động tồn kho cũ hơn số ngày này được lệnh compact_stock_movements gộp thành snapshot
+STOCK_MOVEMENT_RETENTION_DAYS = 90
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 